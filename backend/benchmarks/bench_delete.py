@@ -0,0 +1,74 @@
+'''
+Benchmark for deleting questions.
+
+Times one DELETE /questions/<id> answered the old way (every question
+sent back), the default way (one page) and with lean=true, then deleting
+a batch of ids one request at a time against one DELETE /questions.
+
+    python -m benchmarks.bench_delete --sizes 1000,10000,100000
+'''
+import argparse
+import json
+import os
+import time
+
+from benchmarks.common import make_app, seed_questions, measure, parse_sizes
+from models import Question, db
+
+
+def legacy_delete(question_id):
+    Question.query.get(question_id).delete()
+    questions = Question.query.order_by(db.desc(Question.id)).all()
+    return json.dumps({"deleted": question_id,
+                       "questions": [question.format() for question in questions],
+                       "total_questions": len(questions)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=200)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    client = app.test_client()
+    seeded = 0
+    print("%10s %-22s %12s %10s" % ("rows", "delete", "p50 ms", "bytes"))
+    try:
+        for size in parse_sizes(args.sizes):
+            seed_questions(app, size - seeded, seed=size)
+            seeded = size
+            # every call deletes another question, newest first
+            ids = iter(range(size, 0, -1))
+            with app.app_context():
+                legacy = measure(lambda: legacy_delete(next(ids)),
+                                 repeat=max(3, args.repeat // 4))
+                size_legacy = len(legacy_delete(next(ids)))
+            print("%10d %-22s %12.2f %10d" % (size, "old, all questions",
+                                              legacy["p50_ms"], size_legacy))
+            for name, query in (("default, one page", ""), ("lean", "?lean=true")):
+                stats = measure(lambda: client.delete(
+                    "/questions/{}{}".format(next(ids), query)), repeat=args.repeat)
+                body = client.delete("/questions/{}{}".format(next(ids), query)).data
+                print("%10d %-22s %12.2f %10d" % (size, name, stats["p50_ms"], len(body)))
+
+            batch = [next(ids) for _ in range(args.batch)]
+            start = time.perf_counter()
+            for question_id in batch:
+                client.delete("/questions/{}?lean=true".format(question_id))
+            single = (time.perf_counter() - start) * 1000
+            batch = [next(ids) for _ in range(args.batch)]
+            start = time.perf_counter()
+            client.delete("/questions", json={"ids": batch})
+            bulk = (time.perf_counter() - start) * 1000
+            print("%10d %-22s %12.2f" % (size, "%d one by one" % args.batch, single))
+            print("%10d %-22s %12.2f" % (size, "%d in one request" % args.batch, bulk))
+            with app.app_context():
+                seeded = Question.query.count()
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+'''
+Benchmark for GET /questions/export.
+
+Streams the whole table as the client reads it and reports rows per
+second and the peak memory traced while exporting, which should stay flat
+as the table grows.
+
+    python -m benchmarks.bench_export --sizes 10000,100000,1000000
+'''
+import argparse
+import os
+import time
+import tracemalloc
+
+from benchmarks.common import make_app, seed_questions, parse_sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    args = parser.parse_args()
+
+    app, path = make_app()
+    client = app.test_client()
+    seeded = 0
+    print("%10s %12s %12s %12s" % ("rows", "rows/s", "MB sent", "peak MB"))
+    try:
+        for size in parse_sizes(args.sizes):
+            seed_questions(app, size - seeded, seed=size)
+            seeded = size
+            tracemalloc.start()
+            start = time.perf_counter()
+            response = client.get("/questions/export", buffered=False)
+            sent = lines = 0
+            for chunk in response.iter_encoded():
+                sent += len(chunk)
+                lines += chunk.count(b"\n")
+            response.close()
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("%10d %12.0f %12.1f %12.1f" %
+                  (lines, lines / seconds, sent / 2 ** 20, peak / 2 ** 20))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
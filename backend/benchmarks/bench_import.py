@@ -0,0 +1,66 @@
+'''
+Benchmark for the bulk question import.
+
+Streams a generated NDJSON content pack through POST /questions/import
+and reports rows per second and the peak memory traced while importing,
+next to adding questions one at a time through POST /questions.
+
+    python -m benchmarks.bench_import --rows 500000
+'''
+import argparse
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from benchmarks.common import make_app, random_words
+
+
+def content_pack(rows, seed=0):
+    rnd = random.Random(seed)
+    for i in range(rows):
+        yield (json.dumps({
+            "question": "Imported question %d about %s?" % (i, random_words(rnd, 6)),
+            "answer": random_words(rnd, 2),
+            "difficulty": rnd.randint(1, 5),
+            "category": rnd.randint(1, 6),
+        }) + "\n").encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--single", type=int, default=500,
+                        help="questions added one request at a time")
+    args = parser.parse_args()
+
+    app, path = make_app()
+    client = app.test_client()
+    try:
+        start = time.perf_counter()
+        for line in content_pack(args.single, seed=1):
+            client.post("/questions", json=json.loads(line))
+        single = args.single / (time.perf_counter() - start)
+        print("POST /questions one by one: %10.0f rows/s" % single)
+
+        with open(path + ".ndjson", "wb") as pack:
+            pack.writelines(content_pack(args.rows))
+        with open(path + ".ndjson", "rb") as pack:
+            tracemalloc.start()
+            report = client.post("/questions/import", input_stream=pack,
+                                 content_length=os.path.getsize(pack.name),
+                                 content_type="application/x-ndjson").get_json()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        print("POST /questions/import:     %10.0f rows/s  (%d rows, %d batches, %.1fs, peak %.1f MB)"
+              % (report["rows_per_second"], report["imported"], report["batches"],
+                 report["seconds"], peak / 2 ** 20))
+    finally:
+        os.remove(path)
+        if os.path.exists(path + ".ndjson"):
+            os.remove(path + ".ndjson")
+
+
+if __name__ == "__main__":
+    main()
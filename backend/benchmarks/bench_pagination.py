@@ -0,0 +1,52 @@
+'''
+Benchmark for GET /questions pagination.
+
+Grows the questions table from 1k to 1M rows and times a first page, a
+deep page and a category page at each size. With the page fetched by
+LIMIT/OFFSET and the total served from the cached count, latency should
+stay flat as the table grows. The last two rows compare the page in the
+middle of the table reached by OFFSET and by a keyset cursor.
+
+    python -m benchmarks.bench_pagination --sizes 1000,10000,100000,1000000
+'''
+import argparse
+import os
+
+from benchmarks.common import make_app, seed_questions, measure, parse_sizes
+from flaskr import encode_cursor, QUESTIONS_PER_PAGE
+
+ROUTES = ["/questions?page=1", "/questions?page=50",
+          "/categories/1/questions?page=1"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    client = app.test_client()
+    seeded = 0
+    print("%10s  %-40s %10s %10s" % ("rows", "route", "p50 ms", "p95 ms"))
+    try:
+        for size in parse_sizes(args.sizes):
+            seed_questions(app, size - seeded, seed=size)
+            seeded = size
+            middle = size // QUESTIONS_PER_PAGE // 2
+            deep_routes = [
+                "/questions?page=%d" % middle,
+                # ids are 1..size, so this cursor lands on the same page
+                "/questions?cursor=" + encode_cursor(
+                    size - (middle - 1) * QUESTIONS_PER_PAGE + 1),
+            ]
+            for route in ROUTES + deep_routes:
+                stats = measure(lambda: client.get(route), repeat=args.repeat)
+                print("%10d  %-40s %10.2f %10.2f" %
+                      (size, route, stats["p50_ms"], stats["p95_ms"]))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+'''
+Benchmark of the question index (flaskr.question_index).
+
+For each table size, reports the time to build the index from the
+database, the memory it holds (measured with tracemalloc) and that memory
+per million questions, then times a difficulty-filtered category page and
+a 5-question quiz round of the same app against an app running with
+QUESTION_INDEX=False, which answers them with queries.
+
+    python -m benchmarks.bench_question_index --sizes 10000,100000,1000000
+'''
+import argparse
+import os
+import time
+import tracemalloc
+
+from benchmarks.common import make_app, seed_questions, measure, parse_sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    plain, _ = make_app(path, QUESTION_INDEX=False)
+    index = app.extensions["question_index"]
+    clients = {"index": app.test_client(), "queries": plain.test_client()}
+    page = "/categories/1/questions?difficulty=3&page=3"
+    round_body = {"quiz_category": 1, "previous_questions": [], "count": 5, "difficulty": 3}
+    seeded = 0
+    print("%10s %10s %10s %12s %-8s %12s %12s" % (
+        "rows", "build s", "index MB", "MB/million", "path", "page p50 ms", "quiz p50 ms"))
+    try:
+        for size in parse_sizes(args.sizes):
+            seed_questions(app, size - seeded, seed=size)
+            seeded = size
+            with app.app_context():
+                start = time.perf_counter()
+                index.rebuild()
+                build = time.perf_counter() - start
+                # let go of the arrays, so tracemalloc sees all of them allocated
+                index._ids = {}
+                tracemalloc.start()
+                index.rebuild()
+                held = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+            for name, client in clients.items():
+                page_stats = measure(lambda: client.get(page), repeat=args.repeat)
+                quiz_stats = measure(lambda: client.post("/quizzes", json=round_body),
+                                     repeat=args.repeat)
+                print("%10d %10.2f %10.2f %12.2f %-8s %12.2f %12.2f" % (
+                    size, build, held / 1e6, held / size, name,
+                    page_stats["p50_ms"], quiz_stats["p50_ms"]))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
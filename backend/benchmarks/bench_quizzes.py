@@ -0,0 +1,64 @@
+'''
+Benchmark for one POST /quizzes turn.
+
+Times a turn for the 'All' round and a single category with 0, 100 and
+500 previous questions, as the table grows up to 1M questions. The old
+path, which loaded every unseen question and picked one with
+random.choice, is timed next to it on the smaller sizes (--legacy-max).
+
+    python -m benchmarks.bench_quizzes --sizes 10000,100000,1000000
+'''
+import argparse
+import os
+import random
+
+from benchmarks.common import make_app, seed_questions, measure, parse_sizes
+from models import Question
+
+
+def legacy_turn(category, previous_questions):
+    query = Question.query.filter(Question.id.notin_(previous_questions))
+    if category:
+        query = query.filter(Question.category == category)
+    return random.choice(query.all()).format()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--rounds", default="0,100,500")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--legacy-max", type=int, default=100000,
+                        help="largest table the old path is timed on")
+    args = parser.parse_args()
+
+    app, path = make_app()
+    client = app.test_client()
+    seeded = 0
+    print("%10s %9s %7s %12s %12s" %
+          ("rows", "category", "round", "turn p50 ms", "legacy p50 ms"))
+    try:
+        for size in parse_sizes(args.sizes):
+            seed_questions(app, size - seeded, seed=size)
+            seeded = size
+            for category in (0, 1):
+                for length in parse_sizes(args.rounds):
+                    previous = random.sample(range(1, size + 1), length)
+                    body = {"quiz_category": category,
+                            "previous_questions": previous}
+                    stats = measure(lambda: client.post("/quizzes", json=body),
+                                    repeat=args.repeat)
+                    legacy = float("nan")
+                    if size <= args.legacy_max:
+                        with app.app_context():
+                            legacy = measure(
+                                lambda: legacy_turn(category, previous),
+                                repeat=max(3, args.repeat // 10))["p50_ms"]
+                    print("%10d %9d %7d %12.2f %12.2f" %
+                          (size, category, length, stats["p50_ms"], legacy))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+'''
+Benchmark for the question lookup indexes.
+
+Builds a questions table the way the old models created it (category as
+a string, no index), times the category lookups and prints their query
+plans, then lets setup_db migrate the same database and does it again.
+Runs on SQLite, the plans read "SCAN" before and "SEARCH ... USING INDEX"
+after.
+
+    python -m benchmarks.bench_schema --rows 1000000
+'''
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.common import CATEGORIES, random_words
+from flaskr import create_app
+
+QUERIES = {
+    "category page": ("SELECT id, question, answer, category, difficulty FROM questions "
+                      "WHERE category = 3 ORDER BY id DESC LIMIT 10 OFFSET 1000"),
+    "category total": "SELECT count(id) FROM questions WHERE category = 3",
+    "quiz lowest id": "SELECT min(id) FROM questions WHERE category = 3",
+    "quiz seek": ("SELECT id FROM questions WHERE category = 3 AND id >= 500000 "
+                  "ORDER BY id LIMIT 1"),
+    "difficulty total": ("SELECT count(id) FROM questions "
+                         "WHERE category = 3 AND difficulty = 2"),
+}
+
+
+def report(connection, label, repeat):
+    print("-- " + label)
+    for name, sql in QUERIES.items():
+        plan = "; ".join(row[-1] for row in
+                         connection.execute("EXPLAIN QUERY PLAN " + sql))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(sql).fetchall()
+        took = (time.perf_counter() - start) * 1000 / repeat
+        print("%-18s %9.2f ms  %s" % (name, took, plan))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix=".db", prefix="trivia_bench_")
+    os.close(handle)
+    try:
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE categories (id INTEGER PRIMARY KEY, type VARCHAR)")
+        connection.execute("CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, "
+                           "answer VARCHAR, category VARCHAR, difficulty INTEGER)")
+        connection.executemany("INSERT INTO categories (type) VALUES (?)",
+                               [(name,) for name in CATEGORIES])
+        rnd = random.Random(0)
+        connection.executemany(
+            "INSERT INTO questions (question, answer, category, difficulty) VALUES (?, ?, ?, ?)",
+            ((random_words(rnd, 6), random_words(rnd, 2),
+              str(rnd.randint(1, len(CATEGORIES))), rnd.randint(1, 5))
+             for _ in range(args.rows)))
+        connection.commit()
+        report(connection, "before, %d rows" % args.rows, args.repeat)
+        connection.close()
+
+        create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + path})
+
+        connection = sqlite3.connect(path)
+        connection.execute("ANALYZE")
+        report(connection, "after migrating", args.repeat)
+        connection.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
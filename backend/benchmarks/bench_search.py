@@ -0,0 +1,76 @@
+'''
+Benchmark for POST /questions/search.
+
+Compares the full-text search with the ILIKE scan it replaced, for a
+common word, a rare word, a prefix and two words, as the table grows,
+and times the same searches repeated against the search cache.
+On SQLite this exercises the in-process inverted index (its build time
+is reported separately), point --database at PostgreSQL to time the
+tsvector/GIN path instead.
+
+    python -m benchmarks.bench_search --sizes 10000,100000,1000000
+'''
+import argparse
+import os
+import time
+
+from benchmarks.common import (make_app, seed_questions, measure, parse_sizes,
+                               WORDS)
+from models import Question, db
+
+TERMS = {
+    "common word": WORDS[0],
+    "rare word": WORDS[5000],
+    "prefix": WORDS[1][:4],
+    "two words": WORDS[0] + " " + WORDS[1],
+}
+
+
+def ilike_search(term):
+    pattern = '%' + term + '%'
+    return [question.format() for question in Question.query.filter(
+        db.or_(Question.question.ilike(pattern), Question.answer.ilike(pattern))
+    ).order_by(db.desc(Question.id)).limit(10).all()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    cached, path = make_app()
+    app, _ = make_app(path, SEARCH_CACHE=False)
+    client, cached_client = app.test_client(), cached.test_client()
+    seeded = 0
+    print("%10s %-12s %14s %14s %14s" % (
+        "rows", "term", "search p50 ms", "ilike p50 ms", "cached p50 ms"))
+    try:
+        for size in parse_sizes(args.sizes):
+            seed_questions(app, size - seeded, seed=size)
+            seeded = size
+            app.extensions.pop("search_index", None)
+            # the seed doesn't go through the write hooks
+            cached.extensions.pop("search_index", None)
+            cached.extensions["search_cache"].clear()
+            start = time.perf_counter()
+            client.post("/questions/search", json={"searchTerm": WORDS[0]})
+            print("%10d %-12s %14.2f" % (size, "first call",
+                                         (time.perf_counter() - start) * 1000))
+            for name, term in TERMS.items():
+                body = {"searchTerm": term}
+                stats = measure(lambda: client.post("/questions/search", json=body),
+                                repeat=args.repeat)
+                with app.app_context():
+                    legacy = measure(lambda: ilike_search(term),
+                                     repeat=max(3, args.repeat // 5))
+                hit = measure(lambda: cached_client.post("/questions/search", json=body),
+                              repeat=args.repeat)
+                print("%10d %-12s %14.2f %14.2f %14.2f" %
+                      (size, name, stats["p50_ms"], legacy["p50_ms"], hit["p50_ms"]))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
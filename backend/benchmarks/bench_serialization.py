@@ -0,0 +1,56 @@
+'''
+Benchmark of building and encoding lists of questions.
+
+Compares the former path, Question objects turned into dicts by format()
+and encoded by Flask's jsonify, with column tuples (question_rows) encoded
+by each serializer of flaskr.serialization, for lists of 10 to 10000
+questions. Reports the time to load the rows and the time to encode them.
+
+    python -m benchmarks.bench_serialization --sizes 10,100,1000,10000
+'''
+import argparse
+import os
+
+from flask import jsonify as flask_jsonify
+
+from benchmarks.common import make_app, seed_questions, measure, parse_sizes
+from flaskr.serialization import SERIALIZERS, dumps
+from models import Question, db, question_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    sizes = parse_sizes(args.sizes)
+    app, path = make_app()
+    seed_questions(app, max(sizes))
+    serializers = sorted(SERIALIZERS)
+    print("%8s %-22s %12s %12s %12s" % ("rows", "path", "load ms", "encode ms", "total ms"))
+    try:
+        with app.test_request_context():
+            for size in sizes:
+                query = Question.query.order_by(db.desc(Question.id)).limit(size)
+
+                objects = [question.format() for question in query.all()]
+                load = measure(lambda: [question.format() for question in query.all()],
+                               repeat=args.repeat)["p50_ms"]
+                encode = measure(lambda: flask_jsonify(objects), repeat=args.repeat)["p50_ms"]
+                print("%8d %-22s %12.2f %12.2f %12.2f" % (
+                    size, "objects + jsonify", load, encode, load + encode))
+
+                rows = question_rows(query)
+                load = measure(lambda: question_rows(query), repeat=args.repeat)["p50_ms"]
+                for serializer in serializers:
+                    encode = measure(lambda: dumps(rows, serializer),
+                                     repeat=args.repeat)["p50_ms"]
+                    print("%8d %-22s %12.2f %12.2f %12.2f" % (
+                        size, "rows + " + serializer, load, encode, load + encode))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+'''
+Benchmark of the write-behind group commit (flaskr.write_behind).
+
+Sends POST /questions from `--clients` threads at once, each through its
+own test client, against the per-row path (one transaction per question,
+then the first page re-read) and against WRITE_BEHIND=True with each
+acknowledgement, and reports questions per second, p50 / p99 latency and
+the average group size. Each path writes to its own SQLite file of
+`--questions` seeded questions, with fsync on commit as SQLite does.
+
+    python -m benchmarks.bench_write_behind --clients 1,8,32
+'''
+import argparse
+import os
+import random
+import threading
+import time
+
+from benchmarks.common import make_app, seed_questions, random_words, percentile, parse_sizes
+
+PATHS = {
+    "per-row": {},
+    "write-behind commit": {"WRITE_BEHIND": True},
+    "write-behind queued": {"WRITE_BEHIND": True, "WRITE_BEHIND_ACK": "queued"},
+}
+
+
+def post_questions(app, clients, requests):
+    '''
+    This function posts `requests` questions from each of `clients` threads
+    Returns:
+      - questions per second, sorted latencies in milliseconds, responses that failed
+    '''
+    samples, failures = [], []
+
+    def client(seed):
+        rnd, test_client = random.Random(seed), app.test_client()
+        for _ in range(requests):
+            start = time.perf_counter()
+            res = test_client.post("/questions", json={
+                "question": "Benchmark %s?" % random_words(rnd, 4),
+                "answer": random_words(rnd, 1), "difficulty": rnd.randint(1, 5),
+                "category": rnd.randint(1, 6)})
+            samples.append((time.perf_counter() - start) * 1000)
+            if res.status_code >= 300:
+                failures.append(res.status_code)
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer = app.extensions.get("write_behind")
+    if writer is not None:
+        # the queued acknowledgement answers early, count until it is written
+        writer.close()
+    seconds = time.perf_counter() - start
+    return clients * requests / seconds, sorted(samples), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200, help="questions per client")
+    parser.add_argument("--questions", type=int, default=10000)
+    args = parser.parse_args()
+
+    print("%8s %-20s %12s %10s %10s %10s %8s" % (
+        "clients", "path", "questions/s", "p50 ms", "p99 ms", "avg group", "failed"))
+    for clients in parse_sizes(args.clients):
+        for name, config in PATHS.items():
+            app, path = make_app(QUESTION_INDEX=False, **config)
+            try:
+                seed_questions(app, args.questions)
+                rate, samples, failures = post_questions(app, clients, args.requests)
+                writer = app.extensions.get("write_behind")
+                group = writer.stats()["average_batch"] if writer is not None else 1
+                print("%8d %-20s %12.0f %10.2f %10.2f %10.1f %8d" % (
+                    clients, name, rate, percentile(samples, 0.5), percentile(samples, 0.99),
+                    group, len(failures)))
+            finally:
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+'''
+Shared helpers for the benchmark scripts.
+
+The benchmarks run against a throw-away SQLite database so they need no
+outside services, run them from the backend folder, e.g.
+    python -m benchmarks.bench_pagination
+'''
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flaskr import create_app
+from models import db, Question, Category, invalidate_question_counts
+
+CATEGORIES = ["Science", "Art", "Geography",
+              "History", "Entertainment", "Sports"]
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vo", "zu", "pe"]
+# 10k made-up words, drawn with a skew so some words are common and most are rare
+WORDS = [a + b + c + d for a in SYLLABLES for b in SYLLABLES
+         for c in SYLLABLES for d in SYLLABLES]
+random.Random(42).shuffle(WORDS)
+
+
+def random_words(rnd, count, skew=3):
+    '''
+    draws `count` words, the higher the skew the more often the first words of WORDS come up
+    '''
+    return " ".join(WORDS[int(len(WORDS) * rnd.random() ** skew)]
+                    for _ in range(count))
+
+
+def make_app(path=None, categories=len(CATEGORIES), **config):
+    '''
+    This function creates the app bound to a fresh SQLite database file,
+    with `categories` categories and any other config given
+    Returns:
+      - the app
+      - the database file path
+    '''
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix=".db", prefix="trivia_bench_")
+        os.close(handle)
+        os.remove(path)
+    config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + path
+    # one client sends every request, it would only measure the rate limits
+    config.setdefault("ADMISSION_CONTROL", False)
+    app = create_app(config)
+    names = (CATEGORIES + ["Category %d" % (i + 1) for i in range(len(CATEGORIES), categories)])
+    with app.app_context():
+        if not Category.query.count():
+            db.session.execute(Category.__table__.insert(),
+                               [{"type": name} for name in names[:categories]])
+            db.session.commit()
+    return app, path
+
+
+def seed_questions(app, count, batch=50000, seed=0, category_skew=0, word_skew=3):
+    '''
+    This function appends `count` synthetic questions spread over the
+    categories, inserted in batches with executemany.
+    With a category_skew above 0 the categories get Zipf-like shares, the
+    first one the most, word_skew sets how common the common words are
+    '''
+    rnd = random.Random(seed)
+    table = Question.__table__
+    with app.app_context():
+        category_ids = [category_id for (category_id,) in
+                        db.session.query(Category.id).order_by(Category.id)]
+        weights = [1 / (rank + 1) ** category_skew for rank in range(len(category_ids))]
+        start = db.session.query(db.func.count(Question.id)).scalar()
+        for offset in range(0, count, batch):
+            rows = []
+            for i in range(start + offset, start + min(offset + batch, count)):
+                rows.append({
+                    "question": "Question %d about %s?" % (i, random_words(rnd, 6, word_skew)),
+                    "answer": random_words(rnd, 2, word_skew).capitalize(),
+                    "category": rnd.choices(category_ids, weights)[0],
+                    "difficulty": rnd.randint(1, 5),
+                })
+            db.session.execute(table.insert(), rows)
+            db.session.commit()
+        invalidate_question_counts()
+        if "question_index" in app.extensions:
+            app.extensions["question_index"].rebuild()
+
+
+def measure(fn, repeat=50, warmup=3):
+    '''
+    This function calls `fn` repeatedly
+    Returns:
+      - dict of mean / p50 / p95 / p99 latency in milliseconds
+    '''
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": statistics.mean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+    }
+
+
+def percentile(samples, fraction):
+    '''
+    returns the value below which `fraction` of the sorted samples fall
+    '''
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def parse_sizes(text):
+    return [int(float(size)) for size in text.split(",")]
@@ -0,0 +1,180 @@
+'''
+Load test of the WSGI app (create_app) against the ASGI one (flaskr.asgi).
+
+Opens `--clients` keep-alive HTTP/1.1 connections that send requests back
+to back for `--duration` seconds and reports requests per second and the
+p50 / p99 latency of each server. By default both servers are started on
+a seeded throw-away SQLite database: the threaded Werkzeug server for
+WSGI and uvicorn for ASGI (requirements-async.txt). Point it at servers of
+your own, e.g. gunicorn and uvicorn workers on PostgreSQL, with --wsgi-url
+and --asgi-url.
+
+    python -m benchmarks.loadtest --clients 500 --duration 20
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.common import make_app, seed_questions
+
+WSGI_PORT = 5100
+ASGI_PORT = 5101
+
+
+def requests_mix(rnd):
+    '''
+    This function returns one request of the mix: mostly page reads, some searches and quiz picks
+    '''
+    roll = rnd.random()
+    if roll < 0.4:
+        return "GET", "/questions?page=%d" % rnd.randint(1, 50), None
+    if roll < 0.6:
+        return "GET", "/categories/%d/questions" % rnd.randint(1, 6), None
+    if roll < 0.7:
+        return "GET", "/categories", None
+    if roll < 0.85:
+        return "POST", "/questions/search", {"searchTerm": "question %d" % rnd.randint(1, 999)}
+    return "POST", "/quizzes", {"quiz_category": rnd.randint(0, 6), "previous_questions": []}
+
+
+async def client(host, port, deadline, latencies, errors, seed):
+    rnd = random.Random(seed)
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors.append("connect")
+        return
+    try:
+        while time.perf_counter() < deadline:
+            method, path, body = requests_mix(rnd)
+            payload = b"" if body is None else json.dumps(body).encode()
+            start = time.perf_counter()
+            writer.write((
+                "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n"
+                "Content-Length: {}\r\n\r\n".format(method, path, host, len(payload))
+            ).encode() + payload)
+            status = await reader.readline()
+            # the Werkzeug server speaks HTTP/1.0 and closes after every response
+            length, close = 0, status.startswith(b"HTTP/1.0")
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+                elif name.lower() == "connection" and "close" in value.lower():
+                    close = True
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if not status.split(b" ")[1].startswith((b"2", b"4")):
+                errors.append(status)
+            if close:
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+    except (OSError, asyncio.IncompleteReadError, IndexError) as e:
+        errors.append(repr(e))
+    finally:
+        writer.close()
+
+
+async def run(url, clients, duration):
+    '''
+    This function runs the load against one server
+    Returns:
+      - dict of requests per second, p50 / p99 latency in milliseconds and errors
+    '''
+    address = urlsplit(url)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(address.hostname, address.port or 80, start + duration, latencies, errors, seed)
+        for seed in range(clients)])
+    seconds = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / seconds,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+        "errors": len(errors),
+    }
+
+
+def wait_for(url, timeout=30):
+    import urllib.request
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + "/categories", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server at %s did not start" % url)
+
+
+def start_servers(path):
+    '''
+    This function starts the threaded Werkzeug server and uvicorn on the database file
+    '''
+    database_url = "sqlite:///" + path
+    wsgi = subprocess.Popen([sys.executable, "-c", (
+        "from flaskr import create_app; "
+        "create_app({{'SQLALCHEMY_DATABASE_URI': {!r}, 'ADMISSION_CONTROL': False}})"
+        ".run(port={}, threaded=True)"
+    ).format(database_url, WSGI_PORT)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    asgi = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "flaskr.asgi:app", "--port", str(ASGI_PORT),
+         "--log-level", "warning", "--no-access-log"],
+        env=dict(os.environ, TRIVIA_DATABASE_URL=database_url))
+    return [wsgi, asgi]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--wsgi-url")
+    parser.add_argument("--asgi-url")
+    args = parser.parse_args()
+
+    servers, path = [], None
+    targets = [("wsgi", args.wsgi_url), ("asgi", args.asgi_url)]
+    if not args.wsgi_url and not args.asgi_url:
+        app, path = make_app()
+        seed_questions(app, args.rows)
+        servers = start_servers(path)
+        targets = [("wsgi", "http://127.0.0.1:%d" % WSGI_PORT),
+                   ("asgi", "http://127.0.0.1:%d" % ASGI_PORT)]
+
+    print("%6s %10s %10s %10s %10s %8s" % ("server", "requests", "rps", "p50 ms", "p99 ms", "errors"))
+    try:
+        for name, url in targets:
+            if not url:
+                continue
+            wait_for(url)
+            result = asyncio.run(run(url, args.clients, args.duration))
+            print("%6s %10d %10.0f %10.1f %10.1f %8d" % (
+                name, result["requests"], result["rps"], result["p50_ms"],
+                result["p99_ms"], result["errors"]))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        if path:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
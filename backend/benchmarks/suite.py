@@ -0,0 +1,305 @@
+'''
+Benchmark suite of every route of the API.
+
+Generates a synthetic catalogue on a throw-away SQLite database, sends
+`--requests` requests to each route through the Flask test client and
+through a real HTTP server (the threaded Werkzeug server on a local port)
+and records for each: requests per second, p50 / p95 / p99 latency, peak
+memory traced while serving it, and the responses that weren't 2xx.
+
+The results are written as JSON, give the file of an earlier run to
+--compare to see what got slower:
+
+    python -m benchmarks.suite --questions 100000 --output before.json
+    git checkout my-branch
+    python -m benchmarks.suite --questions 100000 --output after.json --compare before.json
+'''
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+
+from werkzeug.serving import make_server
+
+from benchmarks.common import make_app, seed_questions, random_words, percentile
+from models import Question, db
+
+MEMORY_SAMPLES = 5
+
+
+def routes(app, rnd, categories, session_ids):
+    '''
+    This function returns (name, request) pairs, one for every route of the API.
+    Each request() returns the method, path, body and content type of a new request;
+    the ones that delete take their ids from the newest questions
+    '''
+    with app.app_context():
+        newest = [question_id for (question_id,) in db.session.query(
+            Question.id).order_by(db.desc(Question.id)).limit(50000)]
+        pages = max(1, db.session.query(db.func.count(Question.id)).scalar() // 10)
+    to_delete = iter(newest)
+
+    def question():
+        return {"question": "Benchmark %s?" % random_words(rnd, 4),
+                "answer": random_words(rnd, 1), "difficulty": rnd.randint(1, 5),
+                "category": rnd.randint(1, categories)}
+
+    import_body = "".join(json.dumps(question()) + "\n" for _ in range(100))
+    session = iter(session_ids)
+
+    return [
+        ("GET /categories", lambda: ("GET", "/categories", None, None)),
+        ("GET /questions", lambda: ("GET", "/questions?page=%d" % rnd.randint(1, 20), None, None)),
+        ("GET /questions deep page", lambda: ("GET", "/questions?page=%d" % rnd.randint(
+            (pages + 1) // 2, pages), None, None)),
+        ("GET /questions cursor", lambda: ("GET", "/questions?cursor=", None, None)),
+        ("GET /categories/<id>/questions", lambda: (
+            "GET", "/categories/%d/questions" % rnd.randint(1, categories), None, None)),
+        ("POST /questions/search", lambda: (
+            "POST", "/questions/search", {"searchTerm": random_words(rnd, 1)}, None)),
+        ("POST /questions", lambda: ("POST", "/questions", question(), None)),
+        ("DELETE /questions/<id>", lambda: (
+            "DELETE", "/questions/%d" % next(to_delete), None, None)),
+        ("DELETE /questions/<id> lean", lambda: (
+            "DELETE", "/questions/%d?lean=true" % next(to_delete), None, None)),
+        ("DELETE /questions", lambda: (
+            "DELETE", "/questions", {"ids": [next(to_delete) for _ in range(10)]}, None)),
+        ("POST /questions/import", lambda: (
+            "POST", "/questions/import", import_body, "application/x-ndjson")),
+        ("POST /quizzes", lambda: ("POST", "/quizzes", {
+            "quiz_category": rnd.randint(0, categories),
+            "previous_questions": [rnd.randint(1, len(newest)) for _ in range(5)]}, None)),
+        ("POST /quizzes/sessions", lambda: ("POST", "/quizzes/sessions", {
+            "quiz_category": rnd.randint(0, categories), "size": 10}, None)),
+        ("POST /quizzes/sessions/<id>/next", lambda: (
+            "POST", "/quizzes/sessions/%s/next" % session_ids[0], None, None)),
+        ("DELETE /quizzes/sessions/<id>", lambda: (
+            "DELETE", "/quizzes/sessions/%s" % next(session), None, None)),
+        ("GET /stats", lambda: ("GET", "/stats", None, None)),
+        ("GET /metrics", lambda: ("GET", "/metrics", None, None)),
+    ]
+
+
+def export_routes(categories, rnd):
+    '''
+    the routes that send the whole table, run fewer times
+    '''
+    return [
+        ("GET /questions/export", lambda: (
+            "GET", "/questions/export?category=%d" % rnd.randint(1, categories), None, None)),
+        ("GET /categories/export", lambda: ("GET", "/categories/export", None, None)),
+    ]
+
+
+class TestClientTransport:
+    name = "test client"
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method, path, body, content_type):
+        if isinstance(body, str):
+            response = self.client.open(path, method=method, data=body,
+                                        content_type=content_type)
+        else:
+            response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    name = "http"
+
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def send(self, method, path, body, content_type):
+        if body is None:
+            payload = None
+        elif isinstance(body, str):
+            payload = body.encode()
+        else:
+            payload, content_type = json.dumps(body).encode(), "application/json"
+        # the Werkzeug server closes the connection after every response
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        try:
+            connection.request(method, path, payload,
+                               {"Content-Type": content_type} if content_type else {})
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run_route(transport, request, count):
+    '''
+    This function sends `count` requests one after another
+    Returns:
+      - dict of throughput, latency percentiles, peak memory and failed requests
+    '''
+    samples, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(count):
+        method, path, body, content_type = request()
+        start = time.perf_counter()
+        status = transport.send(method, path, body, content_type)
+        samples.append((time.perf_counter() - start) * 1000)
+        if not 200 <= status < 300:
+            errors += 1
+    seconds = time.perf_counter() - started
+
+    # memory is traced apart, tracing slows every allocation down
+    tracemalloc.start()
+    for _ in range(MEMORY_SAMPLES):
+        transport.send(*request())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "requests": count,
+        "rps": count / seconds,
+        "p50_ms": percentile(samples, 0.50),
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+        "peak_kb": peak / 1024,
+        "errors": errors,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    '''
+    This function prints the change of every latency and throughput from the baseline run
+    Returns:
+      - the number of routes that got slower by more than `threshold` percent
+    '''
+    before = {(row["transport"], row["route"]): row for row in baseline["results"]}
+    regressions = 0
+    print("\nchange from %s (%s)" % (baseline["meta"].get("commit"), baseline["meta"].get("date")))
+    print("%-12s %-34s %9s %9s %9s" % ("transport", "route", "rps", "p50", "p99"))
+    for row in results:
+        old = before.get((row["transport"], row["route"]))
+        if old is None:
+            continue
+        changes = [100.0 * (row[key] - old[key]) / old[key] if old[key] else 0.0
+                   for key in ("rps", "p50_ms", "p99_ms")]
+        slower = changes[1] > threshold or -changes[0] > threshold
+        regressions += slower
+        print("%-12s %-34s %+8.1f%% %+8.1f%% %+8.1f%%%s" % (
+            row["transport"], row["route"], changes[0], changes[1], changes[2],
+            "  slower" if slower else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--categories", type=int, default=6)
+    parser.add_argument("--category-skew", type=float, default=1.0,
+                        help="0 spreads the questions evenly over the categories")
+    parser.add_argument("--word-skew", type=float, default=3.0)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--transport", choices=("client", "http", "both"), default="both")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent slower that counts as a regression")
+    args = parser.parse_args()
+
+    # requests are counted here, not logged
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app, path = make_app(categories=args.categories, METRICS_QUERY_BUDGET=10 ** 6)
+    results = []
+    try:
+        start = time.perf_counter()
+        seed_questions(app, args.questions, seed=args.seed,
+                       category_skew=args.category_skew, word_skew=args.word_skew)
+        print("seeded %d questions in %.1fs" % (args.questions, time.perf_counter() - start))
+
+        transports = {"client": [TestClientTransport], "http": [HTTPTransport],
+                      "both": [TestClientTransport, HTTPTransport]}[args.transport]
+        print("%-12s %-34s %9s %9s %9s %9s %9s %7s" % (
+            "transport", "route", "rps", "p50 ms", "p95 ms", "p99 ms", "peak KB", "errors"))
+        for transport_class in transports:
+            transport = transport_class(app)
+            rnd = random.Random(args.seed)
+            client = app.test_client()
+            session_ids = [json.loads(client.post("/quizzes/sessions", json={
+                "quiz_category": 0}).data)["session_id"]]
+            session_ids += [json.loads(client.post("/quizzes/sessions", json={
+                "quiz_category": 0, "size": 1}).data)["session_id"]
+                for _ in range(args.requests + MEMORY_SAMPLES)]
+            plan = [(name, request, args.requests) for name, request in
+                    routes(app, rnd, args.categories, session_ids)]
+            plan += [(name, request, max(1, args.requests // 20)) for name, request in
+                     export_routes(args.categories, rnd)]
+            try:
+                for name, request, count in plan:
+                    row = run_route(transport, request, count)
+                    row.update({"transport": transport.name, "route": name})
+                    results.append(row)
+                    print("%-12s %-34s %9.0f %9.2f %9.2f %9.2f %9.0f %7d" % (
+                        transport.name, name, row["rps"], row["p50_ms"], row["p95_ms"],
+                        row["p99_ms"], row["peak_kb"], row["errors"]))
+            finally:
+                transport.close()
+    finally:
+        os.remove(path)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "questions": args.questions,
+            "categories": args.categories,
+            "category_skew": args.category_skew,
+            "word_skew": args.word_skew,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print("results written to %s" % args.output)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        if regressions:
+            raise SystemExit("%d routes got slower by more than %.0f%%" % (
+                regressions, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
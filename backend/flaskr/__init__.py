@@ -1,96 +1,305 @@
 import os
-from flask import Flask, request, abort, json, jsonify
+import base64
+import functools
+import weakref
+import queue
+import binascii
+from flask import Flask, request, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
-from werkzeug.exceptions import HTTPException
-from models import setup_db, Question, Category, db
-import sys
+from werkzeug.exceptions import HTTPException, ServiceUnavailable
+from models import setup_db, reset_after_fork, Question, db, database_path, question_count, category_cache, pool_stats, replica_stats
+from models import question_rows, QUESTION_FIELDS
+from models import delete_questions as delete_questions_by_id
+from .quiz import pick_questions, sample_questions, category_query, batch_count
+from .search import cached_search, init_search_cache
+from .conditional import conditional
+from .validation import validate_question
+from .bulk import import_questions, export_questions, export_categories, READERS
+from .commands import register_commands
+from .quiz_sessions import MemorySessionStore, shuffled_deck, SESSION_TTL
+from .metrics import init_metrics, record_error
+from .serialization import jsonify, dumps, SERIALIZERS, DEFAULT_SERIALIZER
+from .compression import init_compression
+from .admission import init_admission
+from .question_index import init_question_index, question_index
+from .snapshot import init_snapshot
+from .write_behind import init_write_behind, ACK_TIMEOUT
 QUESTIONS_PER_PAGE = 10
+# ids a bulk delete takes at once, they are sent as one IN list and older
+# SQLite builds allow 999 parameters per statement
+MAX_DELETE_IDS = 500
 
 
-def pagination(request, data, per_page=10):
+def pagination(request, query, per_page=10, fields=QUESTION_FIELDS):
+    '''
+    This function fetches only the requested page of the given question query
+    using LIMIT/OFFSET, so the rest of the table is never loaded
+    '''
     page = request.args.get('page', 1, type=int)
+    if page < 1:
+        return []
     start = (page - 1) * per_page
-    end = start + per_page
-    items = [item.format() for item in data]
-    return items[start:end]
+    return question_rows(query.offset(start).limit(per_page), fields)
+
+
+def flag(request, name):
+    '''
+    This function reads a yes/no request argument such as `lean=true`
+    '''
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def requested_fields(request):
+    '''
+    This function reads the question fields to send from the `fields` argument,
+    e.g. `fields=id,question`, the id is always sent
+    Returns:
+      - the field names, every field without the argument, aborts with 400 on an unknown field
+    '''
+    fields = request.args.get('fields')
+    if not fields:
+        return QUESTION_FIELDS
+    names = set(field.strip() for field in fields.split(","))
+    if not names <= set(QUESTION_FIELDS):
+        abort(400)
+    return tuple(field for field in QUESTION_FIELDS if field == 'id' or field in names)
+
+
+def requested_difficulty(value):
+    '''
+    This function reads the difficulty filter of a listing or a quiz round
+    Returns:
+      - the difficulty, None without it, aborts with 400 if it isn't a number
+    '''
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def requested_count(request):
+    '''
+    This function reads the number of quiz questions asked for at once from the `count` of the JSON body
+    Returns:
+      - the count, None without it, aborts with 400 unless it is between 1 and MAX_QUIZ_BATCH
+    '''
+    try:
+        return batch_count(request.get_json(silent=True))
+    except ValueError:
+        abort(400)
+
+
+def encode_cursor(question_id):
+    '''
+    This function wraps the last seen question id in an opaque cursor
+    '''
+    return base64.urlsafe_b64encode(
+        "q:{}".format(question_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    '''
+    This function reads the question id back from a cursor, an empty
+    cursor starts from the newest question
+    Returns:
+      - the last seen question id or None, aborts with 400 if the cursor is malformed
+    '''
+    if not cursor:
+        return None
+    try:
+        text = base64.urlsafe_b64decode(
+            cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, question_id = text.split(":")
+        if prefix != "q":
+            raise ValueError(cursor)
+        return int(question_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        abort(400)
+
+
+def keyset_pagination(query, after_id, per_page=10, fields=QUESTION_FIELDS):
+    '''
+    This function fetches the page that follows `after_id` by seeking on
+    Question.id instead of skipping rows, so deep pages cost as much as the first one.
+    The query must be ordered by Question.id descending
+    Returns:
+      - formatted questions
+      - cursor for the next page, None on the last page
+    '''
+    if after_id is not None:
+        query = query.filter(Question.id < after_id)
+    items = question_rows(query.limit(per_page + 1), fields)
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1]['id'])
+    return items, next_cursor
+
+
+def indexed_pagination(request, index, category, difficulty, use_cursor, after_id, fields):
+    '''
+    This function pages through the questions of a category at a difficulty with the ids of the question index,
+    by page number or after the cursor's id, fetching only the rows of the page
+    Returns:
+      - formatted questions
+      - cursor for the next page, None on the last page and in page mode
+    '''
+    if use_cursor:
+        ids = index.newest(category, difficulty, 0, QUESTIONS_PER_PAGE + 1, after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        ids = index.newest(category, difficulty, (page - 1) * QUESTIONS_PER_PAGE,
+                           QUESTIONS_PER_PAGE)
+    next_cursor = None
+    if len(ids) > QUESTIONS_PER_PAGE:
+        ids = ids[:QUESTIONS_PER_PAGE]
+        next_cursor = encode_cursor(ids[-1])
+    return index.questions(ids, fields), next_cursor
+
+
+def after_fork(app_ref):
+    '''
+    This function sets up a worker forked from the process that created the app (gunicorn --preload):
+    its own database connections and its own write-behind thread
+    '''
+    app = app_ref()
+    if app is None:
+        return
+    reset_after_fork(app)
+    writer = app.extensions.get("write_behind")
+    if writer is not None:
+        writer.start()
 
 
 def create_app(test_config=None):
 
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    app.config.setdefault('JSON_SERIALIZER', DEFAULT_SERIALIZER)
+    if app.config['JSON_SERIALIZER'] not in SERIALIZERS:
+        raise ValueError("unknown JSON_SERIALIZER %r, choose one of %s" % (
+            app.config['JSON_SERIALIZER'], ", ".join(SERIALIZERS)))
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+    app.config.setdefault('SNAPSHOT_PATH', os.environ.get('TRIVIA_SNAPSHOT_PATH'))
+    if app.config['SNAPSHOT_PATH']:
+        # the workers share one mapped snapshot of the questions
+        init_snapshot(app, app.config['SNAPSHOT_PATH'])
+    else:
+        init_question_index(app)
+
+    quiz_sessions = app.config.get('QUIZ_SESSION_STORE') or MemorySessionStore(
+        ttl=app.config.get('QUIZ_SESSION_TTL', SESSION_TTL))
+
+    init_write_behind(app)
+    init_search_cache(app)
+    if hasattr(os, "register_at_fork"):
+        # a weak reference, the app may be dropped before any fork
+        os.register_at_fork(after_in_child=functools.partial(after_fork, weakref.ref(app)))
+
+    register_commands(app)
+    init_metrics(app)
+    init_admission(app)
+    init_compression(app)
 
     CORS(app, resources={r"/": {"origins": "*"}})
 
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers',
-                             "Content-Type, Authorization, true")
+                             "Content-Type, Authorization, If-None-Match, true")
+        response.headers.add('Access-Control-Expose-Headers', "ETag")
         response.headers.add('Access-Control-Allow-Methods',
                              "GET,POST,DELETE,OPTIONS")
         return response
 
     @app.route('/')
     @app.route('/categories')
+    @conditional("categories")
     def categories():
-        categories = Category.query.order_by(db.desc(Category.id)).all()
+        categories = category_cache.all()
         if len(categories):
             return jsonify({
                 "success": True,
-                "categories": {category.id: category.type for category in categories}
+                "categories": categories
             })
         else:
             abort(404)
 
     @app.route("/questions")
+    @conditional("questions", "categories")
     def questions():
         '''
-        This function gets all questions paginated based on the current page number
+        This function gets all questions paginated based on the current page number,
+        or on the `cursor` argument when given (an empty cursor starts from the first page).
+        `fields` picks the fields of the questions, `categories=false` leaves the categories out
         Returns:
           - success value
           - paginated questions
           - categories
           - total number of questions
+          - cursor of the next page (cursor mode only)
         '''
+        use_cursor = 'cursor' in request.args
+        after_id = decode_cursor(request.args.get('cursor'))
+        fields = requested_fields(request)
         try:
-            all_questions = Question.query.order_by(
-                db.desc(Question.id)).all()   # Get all questions form the DB
-            paginated_questions = pagination(
-                request, all_questions, QUESTIONS_PER_PAGE)  # paginate the questions
-            all_categories = Category.query.order_by(
-                db.desc(Category.id)).all()  # Get all categories from the DB
-
-            # format the category to suit the frontend
-            formatted_categories = {
-                category.id: category.type for category in all_categories}
+            index = question_index()
+            next_cursor = None
+            if index is not None and index.holds_rows:
+                # the snapshot answers the whole listing
+                paginated_questions, next_cursor = indexed_pagination(
+                    request, index, 0, None, use_cursor, after_id, fields)
+                total_questions = index.count()
+                categories = index.category_map()
+            else:
+                all_questions = Question.query.order_by(
+                    db.desc(Question.id))   # query all questions, only the page is fetched
+                if use_cursor:
+                    paginated_questions, next_cursor = keyset_pagination(
+                        all_questions, after_id, QUESTIONS_PER_PAGE, fields)
+                else:
+                    paginated_questions = pagination(
+                        request, all_questions, QUESTIONS_PER_PAGE, fields)  # paginate the questions
+                total_questions = question_count()
+                categories = None
 
             if len(paginated_questions) == 0:
                 abort(404)
 
             else:
-                return jsonify({
+                response = {
                     "success": True,
                     "questions": paginated_questions,
-                    "categories": formatted_categories,
-                    "total_questions": len(all_questions),
-                    "current_category": ""
-                })
+                    "total_questions": total_questions,
+                    "current_category": "",
+                    "next_cursor": next_cursor
+                }
+                if request.args.get('categories', '').lower() not in ('0', 'false', 'no'):
+                    # categories formatted to suit the frontend, served from memory
+                    response["categories"] = categories or category_cache.all()
+                return jsonify(response)
         except Exception:
             abort(404)
 
     @app.route("/questions/<int:question_id>", methods=["DELETE"])
     def delete_question(question_id):
         '''
-        This function deletes the question with the given ID if EXISTS 
+        This function deletes the question with the given ID if EXISTS,
+        with `lean=true` the questions are only sent back when a `page` is asked for
         Returns:
           - success value
           - paginated questions
           - deleted question ID
           - total number of questions
         '''
+        fields = requested_fields(request)
         try:
             question = Question.query.get(question_id)
             if question is not None:   # check the existance of the requested question
@@ -98,17 +307,49 @@ def create_app(test_config=None):
             else:
                 abort(422)
 
-            questions = Question.query.order_by(db.desc(Question.id)).all()
-
-            return jsonify({
+            response = {
                 "success": True,
                 "deleted": question_id,
-                "questions": [question.format() for question in questions],
-                "total_questions": len(questions)
-            })
+                "total_questions": question_count()
+            }
+            if not flag(request, 'lean') or 'page' in request.args:
+                response["questions"] = pagination(
+                    request, Question.query.order_by(db.desc(Question.id)), QUESTIONS_PER_PAGE, fields)
+            return jsonify(response)
+        except Exception:
+            abort(422)
+
+    @app.route("/questions", methods=["DELETE"])
+    def delete_questions():
+        '''
+        This function deletes every question of the submitted list of ids (at most MAX_DELETE_IDS) in one transaction
+        Returns:
+          - success value
+          - IDs of the deleted questions
+          - total number of questions
+        '''
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        # bool is a subclass of int, true would delete question 1
+        if not isinstance(ids, list) or not 1 <= len(ids) <= MAX_DELETE_IDS or \
+                not all(isinstance(question_id, int) and not isinstance(question_id, bool)
+                        for question_id in ids):
+            abort(400)
+
+        try:
+            deleted = delete_questions_by_id(ids)
         except Exception:
+            db.session.rollback()
+            abort(500)
+        if not deleted:
             abort(422)
 
+        return jsonify({
+            "success": True,
+            "deleted": [question['id'] for question in deleted],
+            "total_questions": question_count()
+        })
+
     @app.route("/questions", methods=["POST"])
     def create_question():
         '''
@@ -117,64 +358,144 @@ def create_app(test_config=None):
           - answer
           - category
           - difficulty
+        With WRITE_BEHIND on, the question is queued and written with others in one transaction
         Returns:
           - success value
-          - paginated questions
+          - id of the question (write-behind: once it is committed, none with WRITE_BEHIND_ACK "queued")
+          - paginated questions (not with write-behind)
           - the inserted question
-          - total number of questions
+          - total number of questions (not with write-behind)
         '''
-        data = request.get_json()
-        # get wuestion data, using 'strip' to remove any leading or trailing spaces
-        question_data = {"question": data['question'].strip(),
-                         "answer": data['answer'].strip(),
-                         "difficulty": data['difficulty'],
-                         "category": data['category']
-                         }
-
-        # check if the question and answer both are not left empty
-        if (question_data['answer'] != "") & (question_data['question'] != "") \
-           & (question_data['category'] is not None) & (question_data['difficulty'] is not None):
+        try:
+            question_data = validate_question(request.get_json(), category_cache.all())
+        except ValueError:
+            abort(400)
+
+        writer = app.extensions.get("write_behind")
+        if writer is not None:
             try:
-                new_question = Question(question=question_data['question'],
-                                        answer=question_data['answer'],
-                                        category=question_data['category'],
-                                        difficulty=question_data['difficulty'])
-                new_question.insert()
-                questions = Question.query.order_by(db.desc(Question.id)).all()
-                paginated_questions = pagination(
-                    request, questions, QUESTIONS_PER_PAGE)
+                pending = writer.submit(question_data)
+            except queue.Full:
+                raise ServiceUnavailable(retry_after=1)
+            if writer.ack == "queued":
                 return jsonify({
                     "success": True,
-                    "questions": paginated_questions,
-                    "inserted_question": question_data,
-                    "total_questions": len(questions)
-                })
+                    "id": None,
+                    "inserted_question": question_data
+                }), 202
+            try:
+                question_id = pending.result(ACK_TIMEOUT)
+            except TimeoutError:
+                # still queued, it may yet be written
+                raise ServiceUnavailable(retry_after=1)
             except Exception:
                 abort(400)
-        else:
+            return jsonify({
+                "success": True,
+                "id": question_id,
+                "inserted_question": question_data
+            })
+
+        fields = requested_fields(request)
+        try:
+            new_question = Question(question=question_data['question'],
+                                    answer=question_data['answer'],
+                                    category=question_data['category'],
+                                    difficulty=question_data['difficulty'])
+            new_question.insert()
+            questions = Question.query.order_by(db.desc(Question.id))
+            paginated_questions = pagination(
+                request, questions, QUESTIONS_PER_PAGE, fields)
+            return jsonify({
+                "success": True,
+                "id": new_question.id,
+                "questions": paginated_questions,
+                "inserted_question": question_data,
+                "total_questions": question_count()
+            })
+        except Exception:
             abort(400)
 
+    @app.route("/questions/import", methods=["POST"])
+    def import_question_file():
+        '''
+        This function streams new questions from the request body into the database in batches,
+        the body is NDJSON, or CSV when sent as text/csv or with `format=csv`
+        Returns:
+          - success value
+          - number of imported and rejected questions, with the first errors
+          - number of batches, seconds taken and rows per second
+          - total number of questions
+        '''
+        format_ = request.args.get('format') or (
+            'csv' if request.mimetype == 'text/csv' else 'ndjson')
+        if format_ not in READERS:
+            abort(400)
+
+        lines = (line.decode('utf-8') for line in request.stream)
+        try:
+            report = import_questions(lines, format_)
+        except UnicodeDecodeError:
+            # the batches before the undecodable line are kept
+            db.session.rollback()
+            abort(400)
+        except Exception:
+            db.session.rollback()
+            abort(500)
+
+        report.update({"success": True, "total_questions": question_count()})
+        return jsonify(report)
+
+    @app.route("/questions/export")
+    def export_question_file():
+        '''
+        This function streams every question as NDJSON, one question per line,
+        optionally only the ones of a `category` and/or `difficulty`
+        Returns:
+          - NDJSON body in the format POST /questions/import reads
+        '''
+        category = request.args.get('category')
+        difficulty = request.args.get('difficulty')
+        try:
+            category = None if category is None else int(category)
+            difficulty = None if difficulty is None else int(difficulty)
+        except ValueError:
+            abort(400)
+
+        return Response(stream_with_context(export_questions(category, difficulty)),
+                        mimetype="application/x-ndjson")
+
+    @app.route("/categories/export")
+    def export_category_file():
+        '''
+        This function streams every category as NDJSON, one category per line
+        '''
+        return Response(stream_with_context(export_categories()),
+                        mimetype="application/x-ndjson")
+
     @app.route("/questions/search", methods=['POST'])
     def search_questions():
         '''
-        This function searches questions according to the given searchTerm and returns them paginated
+        This function searches the question and answer of every question for the given searchTerm
+        and returns the best matches first, paginated, repeated searches are answered from the search cache
         Returns:
           - success value
           - paginated questions
           - total number of questions
         '''
+        fields = requested_fields(request)
         try:
             data = request.get_json()
             search_term = data['searchTerm']
 
-            questions = Question.query.filter(
-                Question.question.ilike('%'+search_term+'%')).all()
-            questions = pagination(request, questions, QUESTIONS_PER_PAGE)
-            total_questions = Question.query.count()
+            page = request.args.get('page', 1, type=int)
+            questions = cached_search(search_term, page, QUESTIONS_PER_PAGE)
+            total_questions = question_count()
 
             return jsonify({
                 "success": True,
-                "questions": questions,
+                "questions": [{field: question[field] for field in fields}
+                              for question in questions],
                 "total_questions": total_questions,
                 "current_category": ""
             })
@@ -182,28 +503,61 @@ def create_app(test_config=None):
             abort(500)
 
     @app.route("/categories/<int:category_id>/questions")
+    @conditional("questions", "categories")
     def get_category_questions(category_id):
         '''
-        This function gets all questions within the given category and they are paginated based on the current page number
+        This function gets all questions within the given category and they are paginated based on the current page number,
+        or on the `cursor` argument when given, `difficulty` keeps the questions of one difficulty only
         Returns:
           - success value
           - paginated questions
           - total number of questions
           - current category
+          - cursor of the next page (cursor mode only)
         '''
+        use_cursor = 'cursor' in request.args
+        after_id = decode_cursor(request.args.get('cursor'))
+        fields = requested_fields(request)
+        difficulty = requested_difficulty(request.args.get('difficulty'))
         try:
-            category_type = Category.query.get(category_id).format()['type']
-            questions = Question.query.filter(
-                Question.category == category_id).all()
-            formatted_questions = pagination(
-                request, questions, QUESTIONS_PER_PAGE)
+            index = question_index()
+            if index is not None and index.holds_rows:
+                category_type = index.category_map().get(category_id)
+            else:
+                category_type = category_cache.get(category_id)
+                if difficulty is None:
+                    # the database pages a whole category as fast
+                    index = None
+            if category_type is None:
+                abort(422)
+            next_cursor = None
+            if index is not None:
+                formatted_questions, next_cursor = indexed_pagination(
+                    request, index, category_id, difficulty, use_cursor, after_id, fields)
+                total_questions = index.count(category_id, difficulty)
+            else:
+                questions = Question.query.filter(Question.category == category_id)
+                if difficulty is not None:
+                    questions = questions.filter(Question.difficulty == difficulty)
+                questions = questions.order_by(db.desc(Question.id))
+                if use_cursor:
+                    formatted_questions, next_cursor = keyset_pagination(
+                        questions, after_id, QUESTIONS_PER_PAGE, fields)
+                else:
+                    formatted_questions = pagination(
+                        request, questions, QUESTIONS_PER_PAGE, fields)
+                if difficulty is not None:
+                    total_questions = questions.order_by(None).count()
+                else:
+                    total_questions = question_count(category_id)
 
-            if len(questions):
+            if total_questions:
                 return jsonify({
                     "success": True,
                     "questions": formatted_questions,
-                    "total_questions": len(questions),
-                    "current_category": category_type
+                    "total_questions": total_questions,
+                    "current_category": category_type,
+                    "next_cursor": next_cursor
                 })
             else:
                 abort(422)
@@ -214,11 +568,15 @@ def create_app(test_config=None):
     @app.route("/quizzes", methods=["POST"])
     def get_quizzes():
         '''
-        This function gets a random question within the selected category that wasn't asked before in the same round
+        This function gets a random question within the selected category that wasn't asked before in the same round,
+        or with `count` that many distinct questions at once, `difficulty` keeps to the questions of one difficulty
         Returns:
           - success value
-          - random question from the DB
+          - random question from the DB, or the list of questions with `count`
         '''
+        count = requested_count(request)
+        data = request.get_json(silent=True)
+        difficulty = requested_difficulty(data.get('difficulty') if isinstance(data, dict) else None)
         try:
             data = request.get_json()
             # since the frontend returns the quiz_category as dict {"type":'click', 'id':1}
@@ -229,26 +587,134 @@ def create_app(test_config=None):
 
             previous_questions = data['previous_questions']
 
-            if category_type == 0:  # if the category was 'All', return all the questions
-                questions = Question.query.filter(
-                    Question.id.notin_(previous_questions)).all()
-            elif category_type:  # else return questions within the selected category
-                questions = Question.query.filter(Question.category == category_type,
-                                                  Question.id.notin_(previous_questions)).all()
+            # 0 is 'All', anything else has to be a category id
+            index = question_index()
+            if index is not None:
+                questions = sample_questions(
+                    index, int(category_type), previous_questions, count or 1, difficulty)
+            else:
+                questions = pick_questions(
+                    int(category_type), previous_questions, count or 1, difficulty)
+            if count is not None:
+                # an empty list ends the round
+                return jsonify({
+                    "success": True,
+                    "questions": questions
+                })
 
-            if len(questions) == 0:  # if the category is not available
+            if not questions:  # if the category is not available
                 question = Question("","",None, None).format()
             else:
-                question = random.choice(questions).format()
+                question = questions[0]
             if question:
                 return jsonify({
                     "success": True,
                     "question": question
                 })
         except Exception:
-            print(sys.exc_info())
             abort(404)
 
+    @app.route("/quizzes/sessions", methods=["POST"])
+    def create_quiz_session():
+        '''
+        This function starts a quiz round on the server by shuffling the ids of the selected category once,
+        an optional `size` limits the number of questions in the round
+        Returns:
+          - success value
+          - session id
+          - number of questions in the round
+        '''
+        try:
+            data = request.get_json()
+            if isinstance(data['quiz_category'], dict):
+                category_type = data['quiz_category']['id']
+            else:
+                category_type = data['quiz_category']
+            size = data.get('size')
+
+            deck = shuffled_deck(category_query(int(category_type)),
+                                 None if size is None else int(size))
+            if not len(deck):
+                abort(404)
+            session_id = quiz_sessions.create(deck)
+        except Exception:
+            abort(404)
+
+        return jsonify({
+            "success": True,
+            "session_id": session_id,
+            "total_questions": len(deck)
+        })
+
+    @app.route("/quizzes/sessions/<session_id>/next", methods=["POST"])
+    def next_session_question(session_id):
+        '''
+        This function serves the next question of a quiz session, an empty question ends the round
+        Returns:
+          - success value
+          - next question
+        '''
+        try:
+            question = None
+            while question is None:
+                question_id = quiz_sessions.next_id(session_id)
+                if question_id is None:
+                    break
+                # skip ids deleted since the round started
+                question = Question.query.get(question_id)
+        except KeyError:
+            abort(404)
+
+        if question is None:
+            question = Question("", "", None, None)
+        return jsonify({
+            "success": True,
+            "question": question.format()
+        })
+
+    @app.route("/quizzes/sessions/<session_id>", methods=["DELETE"])
+    def delete_quiz_session(session_id):
+        '''
+        This function ends a quiz session before its deck is used up
+        Returns:
+          - success value
+          - deleted session id
+        '''
+        if not quiz_sessions.delete(session_id):
+            abort(404)
+        return jsonify({
+            "success": True,
+            "deleted": session_id
+        })
+
+    @app.route("/stats")
+    def stats():
+        '''
+        This function reports how the in-process caches and the database pool are doing
+        Returns:
+          - success value
+          - category cache hits, misses and hit ratio
+          - search cache hits, misses, hit ratio and size
+          - database connections open, checked out and in overflow, time spent waiting for one
+          - health and number of reads of every read replica
+          - runs and corrections of the question counter recounts
+          - size and builds of the question index
+          - questions queued and written in groups by the write-behind queue
+        '''
+        index = app.extensions.get("question_index")
+        writer = app.extensions.get("write_behind")
+        search_cache = app.extensions.get("search_cache")
+        return jsonify({
+            "success": True,
+            "category_cache": category_cache.stats(),
+            "search_cache": search_cache.stats() if search_cache is not None else None,
+            "database_pool": pool_stats(),
+            "database_replicas": replica_stats(),
+            "question_counts": app.extensions["count_reconciler"].stats(),
+            "question_index": index.stats() if index is not None else None,
+            "write_behind": writer.stats() if writer is not None else None
+        })
+
     @app.errorhandler(HTTPException)
     def handle_exception(e):
         '''
@@ -261,9 +727,11 @@ def create_app(test_config=None):
         '''
         # https://flask.palletsprojects.com/en/1.1.x/errorhandling/#generic-exception-handlers
 
+        # log the exception the route turned into this error, if any
+        record_error(e)
         response = e.get_response()
         # replace the body with JSON
-        response.data = json.dumps({
+        response.data = dumps({
             "success": False,
             "error": e.code,
             "message": e.name,
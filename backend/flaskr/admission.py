@@ -0,0 +1,186 @@
+'''
+Admission control for the write and search routes.
+
+Rate limits are token buckets keyed by client and route: a client gets
+`burst` requests at once and `rate` more per second, and is answered 429
+with a Retry-After header past that. The buckets live in a store,
+MemoryRateLimitStore keeps them in this process, RedisRateLimitStore
+shares them between processes; any object with the same take method can
+be passed as RATE_LIMIT_STORE in the app config.
+
+Concurrency limits cap how many requests of a route run at once in this
+process. A request over the cap waits in a queue of `queue` places for up
+to `timeout` seconds, and is answered 503 at once when the queue is full.
+
+Routes are named as in /metrics, "METHOD rule". RATE_LIMITS and
+CONCURRENCY_LIMITS in create_app(test_config) change the defaults below
+for the routes they name, None lifts a route's limit, and
+ADMISSION_CONTROL=False turns every limit off.
+
+Clients are told apart by their address. Behind reverse proxies every
+request comes from the last proxy, so set TRUSTED_PROXIES (or
+TRIVIA_TRUSTED_PROXIES) to the number of proxies in front of the app:
+the address is then taken from X-Forwarded-For, as far back as those
+proxies set it. RATE_LIMIT_KEY, a function of the request, replaces the
+address altogether, e.g. with an API key header.
+'''
+import math
+import os
+import threading
+import time
+
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# route -> (requests per second, burst)
+RATE_LIMITS = {
+    "POST /questions/search": (5, 20),
+    "POST /questions": (2, 10),
+    "DELETE /questions/<int:question_id>": (2, 10),
+    "DELETE /questions": (1, 5),
+    "POST /questions/import": (0.1, 2),
+}
+# route -> (requests run at once, requests queued, seconds a queued request waits)
+CONCURRENCY_LIMITS = {
+    "POST /questions/search": (8, 16, 2),
+    "POST /questions/import": (1, 0, 0),
+    "GET /questions/export": (2, 2, 5),
+}
+# buckets kept in memory before the least recently used one is dropped
+MAX_BUCKETS = 100000
+
+
+class MemoryRateLimitStore:
+    '''
+    Keeps the token buckets in this process
+    '''
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = {}   # key -> [tokens, time of the last refill]
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        '''
+        This function takes one token from the bucket of the key
+        Returns:
+          - seconds until a token is available, 0 when one was taken
+        '''
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = [burst, now]
+                while len(self._buckets) >= self.max_buckets:
+                    # a dropped bucket starts full again, in the client's favour
+                    del self._buckets[next(iter(self._buckets))]
+            # kept last, so the least recently used buckets come first
+            self._buckets[key] = bucket
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+
+class RedisRateLimitStore:
+    '''
+    Keeps the token buckets in Redis, shared by every process using the same server.
+    Takes a client of the redis package, e.g. RedisRateLimitStore(redis.Redis())
+    '''
+
+    # refill and take in one step on the server, with the server's clock
+    SCRIPT = """
+    local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+    local tokens = tonumber(bucket[1]) or burst
+    local at = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + (now - at) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, client, prefix="trivia:rate:"):
+        self.prefix = prefix
+        self._take = client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst):
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst]))
+
+
+class ConcurrencyLimit:
+    '''
+    Lets `limit` requests run at once and `queue` more wait for up to `timeout` seconds
+    '''
+
+    def __init__(self, limit, queue=0, timeout=0):
+        self.timeout = timeout
+        self._running = threading.BoundedSemaphore(limit)
+        # places for the running requests and the queued ones
+        self._places = threading.BoundedSemaphore(limit + queue)
+
+    def acquire(self):
+        if not self._places.acquire(blocking=False):
+            return False
+        if self._running.acquire(timeout=self.timeout):
+            return True
+        self._places.release()
+        return False
+
+    def release(self):
+        self._running.release()
+        self._places.release()
+
+
+def route_limits(defaults, overrides):
+    limits = dict(defaults)
+    limits.update(overrides or {})
+    return {route: limit for route, limit in limits.items() if limit is not None}
+
+
+def init_admission(app):
+    '''
+    This function applies the rate and concurrency limits to the requests of the app
+    '''
+    proxies = int(app.config.get("TRUSTED_PROXIES", os.environ.get("TRIVIA_TRUSTED_PROXIES", 0)))
+    if proxies:
+        # request.remote_addr becomes the client's address for the whole app
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+    if not app.config.get("ADMISSION_CONTROL", True):
+        return
+    client_key = app.config.get("RATE_LIMIT_KEY") or (lambda request: request.remote_addr)
+    rate_limits = route_limits(RATE_LIMITS, app.config.get("RATE_LIMITS"))
+    store = app.config.get("RATE_LIMIT_STORE") or MemoryRateLimitStore()
+    concurrency_limits = {
+        route: ConcurrencyLimit(*limit) for route, limit in
+        route_limits(CONCURRENCY_LIMITS, app.config.get("CONCURRENCY_LIMITS")).items()}
+
+    @app.before_request
+    def admit():
+        if request.url_rule is None:
+            return
+        route = "{} {}".format(request.method, request.url_rule.rule)
+        limit = rate_limits.get(route)
+        if limit is not None:
+            wait = store.take("{}|{}".format(client_key(request), route), *limit)
+            if wait:
+                raise TooManyRequests(retry_after=math.ceil(wait))
+
+        concurrency = concurrency_limits.get(route)
+        if concurrency is not None:
+            if not concurrency.acquire():
+                raise ServiceUnavailable(retry_after=1)
+            g.admitted = concurrency
+
+    @app.teardown_request
+    def release(exception=None):
+        concurrency = g.pop("admitted", None)
+        if concurrency is not None:
+            concurrency.release()
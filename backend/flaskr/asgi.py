@@ -0,0 +1,498 @@
+'''
+Async (ASGI) entry point for the trivia API.
+
+Serves the question, category, search and quiz routes of create_app() on
+asyncio (Starlette) with a pool of async database connections: asyncpg
+for PostgreSQL, aiosqlite for SQLite. Responses are byte for byte the
+JSON the Flask app sends. The routes that keep state in the Flask process
+(quiz sessions, import/export, /stats) are only served by create_app().
+
+Install requirements-async.txt and run it from the backend folder:
+    uvicorn flaskr.asgi:app --workers 4
+
+The database is models.database_path (TRIVIA_DATABASE_URL), the pool is
+sized by the same DB_* settings as setup_db, from TRIVIA_DB_* variables.
+'''
+import asyncio
+import random
+import re
+import time
+
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.exceptions import HTTPException, default_exceptions
+
+from models import database_path, database_setting, COUNT_CACHE_TTL, CATEGORY_CACHE_TTL, QUESTION_FIELDS
+from migrations import ALL_QUESTIONS
+from . import QUESTIONS_PER_PAGE, decode_cursor, encode_cursor
+from .quiz import PICK_ATTEMPTS, batch_count
+from .search import InvertedIndex, tokenize
+from .serialization import dumps
+from .validation import validate_question
+
+QUESTION_COLUMNS = "id, question, answer, category, difficulty"
+
+
+class Database:
+    '''
+    A pool of async connections, asyncpg for PostgreSQL and aiosqlite otherwise.
+    Queries are written with $1, $2 ... placeholders, in order
+    '''
+
+    def __init__(self, url, config=None):
+        self.url = url
+        self.dialect = "postgresql" if url.startswith("postgres") else "sqlite"
+        self.pool_size = database_setting(config, "DB_POOL_SIZE")
+        self.max_overflow = database_setting(config, "DB_MAX_OVERFLOW")
+        self.pool_timeout = database_setting(config, "DB_POOL_TIMEOUT")
+        self.pool_recycle = database_setting(config, "DB_POOL_RECYCLE")
+        self.statement_timeout = database_setting(config, "DB_STATEMENT_TIMEOUT")
+        self.statement_cache_size = database_setting(config, "DB_STATEMENT_CACHE_SIZE")
+        self._pool = None
+
+    async def connect(self):
+        if self.dialect == "postgresql":
+            import asyncpg
+            server_settings = {}
+            if self.statement_timeout:
+                server_settings["statement_timeout"] = str(self.statement_timeout)
+            self._pool = await asyncpg.create_pool(
+                self.url, min_size=self.pool_size,
+                max_size=self.pool_size + self.max_overflow,
+                max_inactive_connection_lifetime=self.pool_recycle,
+                statement_cache_size=self.statement_cache_size,
+                server_settings=server_settings)
+        else:
+            import aiosqlite
+            # SQLite serialises writers anyway, a few connections cover the readers
+            self._pool = asyncio.Queue()
+            path = self.url.split(":///", 1)[1]
+            for _ in range(self.pool_size):
+                self._pool.put_nowait(await aiosqlite.connect(path))
+
+    async def close(self):
+        if self.dialect == "postgresql":
+            await self._pool.close()
+        else:
+            while not self._pool.empty():
+                await self._pool.get_nowait().close()
+
+    async def fetch(self, sql, *args):
+        if self.dialect == "postgresql":
+            async with self._pool.acquire(timeout=self.pool_timeout) as connection:
+                return [tuple(row) for row in await connection.fetch(sql, *args)]
+        connection = await asyncio.wait_for(self._pool.get(), self.pool_timeout)
+        try:
+            cursor = await connection.execute(re.sub(r"\$\d+", "?", sql), args)
+            rows = await cursor.fetchall()
+            await connection.commit()
+            return rows
+        finally:
+            self._pool.put_nowait(connection)
+
+    async def fetchval(self, sql, *args):
+        rows = await self.fetch(sql, *args)
+        return rows[0][0] if rows else None
+
+    def in_list(self, column, position, values, negate=False):
+        '''
+        returns the condition `column IN values`, its placeholders starting at $position,
+        and its arguments: one array on PostgreSQL, one argument per value otherwise
+        '''
+        values = list(values)
+        if self.dialect == "postgresql":
+            condition = "{} {} ALL(${}::int[])" if negate else "{} {} ANY(${}::int[])"
+            return condition.format(column, "<>" if negate else "=", position), [values]
+        placeholders = ", ".join("${}".format(position + i) for i in range(len(values)))
+        return "{} {} ({})".format(column, "NOT IN" if negate else "IN", placeholders), values
+
+
+def format_question(row, fields=QUESTION_FIELDS):
+    return dict(zip(fields, row))
+
+
+def json_response(data, status_code=200):
+    # the same bytes as the Flask app sends
+    return Response(dumps(data), status_code=status_code, media_type="application/json")
+
+
+def abort(code):
+    raise default_exceptions[code]()
+
+
+def requested_fields(request):
+    '''
+    the question fields of create_app()'s `fields` argument, every field without it
+    '''
+    fields = request.query_params.get('fields')
+    if not fields:
+        return QUESTION_FIELDS
+    names = set(field.strip() for field in fields.split(","))
+    if not names <= set(QUESTION_FIELDS):
+        abort(400)
+    return tuple(field for field in QUESTION_FIELDS if field == 'id' or field in names)
+
+
+def requested_difficulty(value):
+    '''
+    the difficulty filter of create_app()'s listings and quiz rounds, None without it
+    '''
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+class TriviaAPI:
+
+    def __init__(self, url, config=None):
+        self.db = Database(url, config)
+        self._categories = (None, 0)
+        self._counts = {}
+        self._search_index = None
+
+    async def categories_map(self):
+        categories, loaded_at = self._categories
+        if categories is None or time.time() - loaded_at > CATEGORY_CACHE_TTL:
+            categories = {row[0]: row[1] for row in await self.db.fetch(
+                "SELECT id, type FROM categories ORDER BY id DESC")}
+            self._categories = (categories, time.time())
+        return categories
+
+    async def question_count(self, category=None):
+        cached = self._counts.get(category)
+        if cached is not None and time.time() - cached[1] < COUNT_CACHE_TTL:
+            return cached[0]
+        total = await self.db.fetchval(
+            "SELECT total FROM question_counts WHERE category = $1",
+            ALL_QUESTIONS if category is None else category) or 0
+        self._counts[category] = (total, time.time())
+        return total
+
+    def questions_changed(self):
+        self._counts.clear()
+        self._search_index = None
+
+    async def page(self, request, where="", args=(), fields=QUESTION_FIELDS):
+        '''
+        fetches one page of questions, newest first, by page number or by cursor
+        returns the formatted questions and the next cursor
+        '''
+        # the id comes first, the cursor is read from it
+        columns = ", ".join(fields)
+        position = len(args) + 1
+        if 'cursor' in request.query_params:
+            after_id = decode_cursor(request.query_params['cursor'])
+            if after_id is not None:
+                where = (where + " AND " if where else "") + "id < ${}".format(position)
+                args = tuple(args) + (after_id,)
+                position += 1
+            rows = await self.db.fetch(
+                "SELECT {} FROM questions {} ORDER BY id DESC LIMIT ${}".format(
+                    columns, "WHERE " + where if where else "", position),
+                *args, QUESTIONS_PER_PAGE + 1)
+            next_cursor = None
+            if len(rows) > QUESTIONS_PER_PAGE:
+                rows = rows[:QUESTIONS_PER_PAGE]
+                next_cursor = encode_cursor(rows[-1][0])
+            return [format_question(row, fields) for row in rows], next_cursor
+
+        try:
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            page = 1
+        if page < 1:
+            return [], None
+        rows = await self.db.fetch(
+            "SELECT {} FROM questions {} ORDER BY id DESC LIMIT ${} OFFSET ${}".format(
+                columns, "WHERE " + where if where else "", position, position + 1),
+            *args, QUESTIONS_PER_PAGE, (page - 1) * QUESTIONS_PER_PAGE)
+        return [format_question(row, fields) for row in rows], None
+
+    async def categories(self, request):
+        categories = await self.categories_map()
+        if not len(categories):
+            abort(404)
+        return json_response({"success": True, "categories": categories})
+
+    async def questions(self, request):
+        if 'cursor' in request.query_params:
+            decode_cursor(request.query_params['cursor'])
+        fields = requested_fields(request)
+        try:
+            questions, next_cursor = await self.page(request, fields=fields)
+            if len(questions) == 0:
+                abort(404)
+            response = {
+                "success": True,
+                "questions": questions,
+                "total_questions": await self.question_count(),
+                "current_category": "",
+                "next_cursor": next_cursor
+            }
+            if request.query_params.get('categories', '').lower() not in ('0', 'false', 'no'):
+                response["categories"] = await self.categories_map()
+            return json_response(response)
+        except Exception:
+            abort(404)
+
+    async def delete_question(self, request):
+        question_id = request.path_params['question_id']
+        fields = requested_fields(request)
+        try:
+            deleted = await self.db.fetch(
+                "DELETE FROM questions WHERE id = $1 RETURNING id", question_id)
+            if not deleted:
+                abort(422)
+            self.questions_changed()
+            response = {
+                "success": True,
+                "deleted": question_id,
+                "total_questions": await self.question_count()
+            }
+            lean = request.query_params.get('lean', '').lower() in ('1', 'true', 'yes')
+            if not lean or 'page' in request.query_params:
+                response["questions"], _ = await self.page(request, fields=fields)
+            return json_response(response)
+        except Exception:
+            abort(422)
+
+    async def create_question(self, request):
+        try:
+            question_data = validate_question(
+                await request.json(), await self.categories_map())
+        except ValueError:
+            abort(400)
+
+        fields = requested_fields(request)
+        try:
+            inserted = await self.db.fetch(
+                "INSERT INTO questions (question, answer, category, difficulty) "
+                "VALUES ($1, $2, $3, $4) RETURNING id",
+                question_data['question'], question_data['answer'],
+                int(question_data['category']), int(question_data['difficulty']))
+            self.questions_changed()
+            questions, _ = await self.page(request, fields=fields)
+            return json_response({
+                "success": True,
+                "id": inserted[0][0],
+                "questions": questions,
+                "inserted_question": question_data,
+                "total_questions": await self.question_count()
+            })
+        except Exception:
+            abort(400)
+
+    async def search(self, term, page):
+        if page < 1:
+            return []
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        words = tokenize(term)
+        if not words:
+            rows = await self.db.fetch(
+                "SELECT {} FROM questions ORDER BY id DESC LIMIT $1 OFFSET $2".format(
+                    QUESTION_COLUMNS), QUESTIONS_PER_PAGE, start)
+            return [format_question(row) for row in rows]
+
+        if self.db.dialect == "postgresql":
+            rows = await self.db.fetch(
+                "SELECT {} FROM questions, to_tsquery('english', $1) AS query "
+                "WHERE search_vector @@ query "
+                "ORDER BY ts_rank(search_vector, query) DESC, id DESC "
+                "LIMIT $2 OFFSET $3".format(QUESTION_COLUMNS),
+                " & ".join(word + ":*" for word in words), QUESTIONS_PER_PAGE, start)
+            return [format_question(row) for row in rows]
+
+        if self._search_index is None:
+            index = InvertedIndex()
+            index.build(await self.db.fetch(
+                "SELECT id, question, answer FROM questions ORDER BY id"))
+            self._search_index = index
+        ids = self._search_index.search(term, start + QUESTIONS_PER_PAGE)[start:]
+        if not ids:
+            return []
+        condition, args = self.db.in_list("id", 1, ids)
+        rows = {row[0]: row for row in await self.db.fetch(
+            "SELECT {} FROM questions WHERE {}".format(QUESTION_COLUMNS, condition), *args)}
+        return [format_question(rows[question_id]) for question_id in ids
+                if question_id in rows]
+
+    async def search_questions(self, request):
+        fields = requested_fields(request)
+        try:
+            data = await request.json()
+            try:
+                page = int(request.query_params.get('page', 1))
+            except ValueError:
+                page = 1
+            questions = await self.search(data['searchTerm'], page)
+            return json_response({
+                "success": True,
+                "questions": [{field: question[field] for field in fields}
+                              for question in questions],
+                "total_questions": await self.question_count(),
+                "current_category": ""
+            })
+        except Exception:
+            abort(500)
+
+    async def category_questions(self, request):
+        category_id = request.path_params['category_id']
+        if 'cursor' in request.query_params:
+            decode_cursor(request.query_params['cursor'])
+        fields = requested_fields(request)
+        difficulty = requested_difficulty(request.query_params.get('difficulty'))
+        try:
+            category_type = (await self.categories_map()).get(category_id)
+            if category_type is None:
+                abort(422)
+            if difficulty is None:
+                questions, next_cursor = await self.page(
+                    request, "category = $1", (category_id,), fields)
+                total_questions = await self.question_count(category_id)
+            else:
+                questions, next_cursor = await self.page(
+                    request, "category = $1 AND difficulty = $2", (category_id, difficulty), fields)
+                total_questions = await self.db.fetchval(
+                    "SELECT count(id) FROM questions WHERE category = $1 AND difficulty = $2",
+                    category_id, difficulty)
+            if not total_questions:
+                abort(422)
+            return json_response({
+                "success": True,
+                "questions": questions,
+                "total_questions": total_questions,
+                "current_category": category_type,
+                "next_cursor": next_cursor
+            })
+        except Exception:
+            abort(422)
+
+    async def pick_questions(self, category, previous_questions, count=1, difficulty=None):
+        '''
+        the random id seeks of quiz.pick_questions
+        '''
+        filters = ([("category", category)] if category != 0 else []) + \
+            ([("difficulty", difficulty)] if difficulty is not None else [])
+        where = "".join("{} = ${} AND ".format(column, position)
+                        for position, (column, _) in enumerate(filters, 1))
+        args = [value for _, value in filters]
+        position = len(args) + 1
+        low = await self.db.fetchval(
+            "SELECT min(id) FROM questions WHERE {}1 = 1".format(where), *args)
+        if low is None:
+            return []
+        high = await self.db.fetchval(
+            "SELECT max(id) FROM questions WHERE {}1 = 1".format(where), *args)
+
+        seen = set(previous_questions)
+        picked = {}
+
+        def keep(rows):
+            for row in rows:
+                if row[0] not in seen and row[0] not in picked:
+                    picked[row[0]] = format_question(row)
+
+        seek = "SELECT * FROM (SELECT {} FROM questions WHERE {}id >= ${} ORDER BY id LIMIT 1) seek{}"
+        for _ in range(PICK_ATTEMPTS):
+            wanted = count - len(picked)
+            if not wanted:
+                return list(picked.values())
+            # placeholders are positional on SQLite, every seek gets its own
+            seeks, seek_args = [], []
+            for i in range(wanted):
+                condition = ""
+                for column, value in filters:
+                    seek_args.append(value)
+                    condition += "{} = ${} AND ".format(column, len(seek_args))
+                seek_args.append(random.randint(low, high))
+                seeks.append(seek.format(QUESTION_COLUMNS, condition, len(seek_args), i))
+            keep(await self.db.fetch(" UNION ALL ".join(seeks), *seek_args))
+
+        wanted = count - len(picked)
+        if wanted:
+            skipped = seen | set(picked)
+            if skipped:
+                condition, skipped_args = self.db.in_list("id", position, skipped, negate=True)
+                where += condition + " AND "
+                args = args + skipped_args
+                position += len(skipped_args)
+            pivot = random.randint(low, high)
+            rows = await self.db.fetch(
+                "SELECT {} FROM questions WHERE {}id >= ${} ORDER BY id LIMIT {}".format(
+                    QUESTION_COLUMNS, where, position, wanted), *args, pivot)
+            if len(rows) < wanted:
+                rows = list(rows) + list(await self.db.fetch(
+                    "SELECT {} FROM questions WHERE {}id < ${} ORDER BY id DESC LIMIT {}".format(
+                        QUESTION_COLUMNS, where, position, wanted - len(rows)), *args, pivot))
+            keep(rows)
+        return list(picked.values())
+
+    async def quizzes(self, request):
+        try:
+            data = await request.json()
+        except Exception:
+            data = None
+        try:
+            count = batch_count(data)
+        except ValueError:
+            abort(400)
+        difficulty = requested_difficulty(data.get('difficulty') if isinstance(data, dict) else None)
+        try:
+            if isinstance(data['quiz_category'], dict):
+                category_type = data['quiz_category']['id']
+            else:
+                category_type = data['quiz_category']
+
+            questions = await self.pick_questions(
+                int(category_type), data['previous_questions'], count or 1, difficulty)
+            if count is not None:
+                return json_response({"success": True, "questions": questions})
+            if not questions:
+                question = {"id": None, "question": "", "answer": "",
+                            "category": None, "difficulty": None}
+            else:
+                question = questions[0]
+            return json_response({"success": True, "question": question})
+        except Exception:
+            abort(404)
+
+
+async def handle_exception(request, e):
+    '''
+    the JSON error body of create_app()'s handler
+    '''
+    if not isinstance(e, HTTPException):
+        e = default_exceptions[e.status_code]()
+    return json_response({
+        "success": False,
+        "error": e.code,
+        "message": e.name,
+        "description": e.description,
+    }, e.code)
+
+
+def create_asgi_app(url=None, config=None):
+    api = TriviaAPI(url or database_path, config)
+    routes = [
+        Route("/", api.categories, methods=["GET"]),
+        Route("/categories", api.categories, methods=["GET"]),
+        Route("/questions", api.questions, methods=["GET"]),
+        Route("/questions", api.create_question, methods=["POST"]),
+        Route("/questions/{question_id:int}", api.delete_question, methods=["DELETE"]),
+        Route("/questions/search", api.search_questions, methods=["POST"]),
+        Route("/categories/{category_id:int}/questions", api.category_questions,
+              methods=["GET"]),
+        Route("/quizzes", api.quizzes, methods=["POST"]),
+    ]
+    return Starlette(routes=routes,
+                     exception_handlers={HTTPException: handle_exception,
+                                         StarletteHTTPException: handle_exception},
+                     on_startup=[api.db.connect], on_shutdown=[api.db.close])
+
+
+app = create_asgi_app()
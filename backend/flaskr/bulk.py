@@ -0,0 +1,184 @@
+'''
+Streaming bulk import and export of questions.
+
+Rows are read one at a time from NDJSON (one JSON object per line) or CSV
+(with a header row naming question, answer, difficulty and category),
+checked with the same rules as POST /questions and written in batches:
+COPY on PostgreSQL, one executemany INSERT elsewhere. Each batch is its
+own transaction, so memory stays the size of one batch whatever the size
+of the file, and a failure keeps the batches already written.
+
+The export goes the other way: rows come from a server-side cursor
+(yield_per) as plain column tuples and are written out as NDJSON chunks,
+in the format the import reads back.
+'''
+import csv
+import io
+import json
+import time
+
+from models import Question, Category, db, notify_question_listeners, category_cache
+from .serialization import dumps
+from .validation import validate_question
+
+BATCH_SIZE = 5000
+# rows fetched from the cursor, and written out, at a time by the export
+EXPORT_CHUNK = 1000
+# rejected rows listed in the report, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+COLUMNS = ("question", "answer", "difficulty", "category")
+
+
+def read_ndjson(lines):
+    '''
+    This function parses one question per line
+    Returns:
+      - (line number, row) pairs, the row is the error message for lines that aren't JSON objects
+    '''
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, "not valid JSON"
+            continue
+        yield number, row if isinstance(row, dict) else "not a JSON object"
+
+
+def read_csv(lines):
+    '''
+    This function parses the CSV rows after the header, whole numbers are
+    turned into integers like the JSON API receives them
+    Returns:
+      - (line number, row) pairs
+    '''
+    reader = csv.DictReader(lines)
+    for row in reader:
+        for column in ("difficulty", "category"):
+            value = (row.get(column) or "").strip()
+            row[column] = int(value) if value.isdigit() else value
+        yield reader.line_num, row
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+def copy_rows(rows):
+    '''
+    This function writes one batch with COPY, through the connection of the current transaction
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in COLUMNS])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert("COPY questions ({}) FROM STDIN WITH (FORMAT csv)".format(
+        ", ".join(COLUMNS)), buffer)
+
+
+def write_batch(rows):
+    if db.engine.dialect.name == "postgresql":
+        copy_rows(rows)
+    else:
+        db.session.execute(Question.__table__.insert(), rows)
+    db.session.commit()
+    # COPY doesn't hand the new ids back, listeners refresh what they derived
+    notify_question_listeners("import", rows)
+
+
+def reject(report, number, error):
+    report["rejected"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append({"line": number, "error": str(error)})
+
+
+def write_numbered_batch(batch, report):
+    '''
+    This function writes a batch of (line number, row) pairs, one row at a time when the
+    database refuses the batch, so only the rows it refuses are rejected
+    '''
+    try:
+        write_batch([row for _, row in batch])
+        report["imported"] += len(batch)
+        report["batches"] += 1
+        return
+    except Exception:
+        db.session.rollback()
+    for number, row in batch:
+        try:
+            write_batch([row])
+            report["imported"] += 1
+            report["batches"] += 1
+        except Exception as error:
+            db.session.rollback()
+            reject(report, number, "refused by the database: {}".format(
+                str(error).splitlines()[0]))
+
+
+def import_questions(lines, format="ndjson", batch_size=BATCH_SIZE):
+    '''
+    This function imports the questions read from the given lines of text
+    Returns:
+      - report of imported and rejected rows, batches, time taken and rows per second
+    '''
+    start = time.perf_counter()
+    report = {"imported": 0, "rejected": 0, "batches": 0, "errors": []}
+    categories = category_cache.all()
+    batch = []
+    for number, row in READERS[format](lines):
+        try:
+            if isinstance(row, str):
+                raise ValueError(row)
+            batch.append((number, validate_question(row, categories)))
+        except ValueError as error:
+            reject(report, number, error)
+            continue
+        if len(batch) >= batch_size:
+            write_numbered_batch(batch, report)
+            batch = []
+    if batch:
+        write_numbered_batch(batch, report)
+
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["rows_per_second"] = round(
+        report["imported"] / report["seconds"]) if report["seconds"] else 0
+    return report
+
+
+def export_questions(category=None, difficulty=None, chunk=EXPORT_CHUNK):
+    '''
+    This function streams every question, optionally of one category and/or difficulty
+    Returns:
+      - generator of NDJSON chunks, UTF-8 bytes
+    '''
+    query = db.session.query(Question.id, Question.question, Question.answer,
+                             Question.difficulty, Question.category)
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return ndjson_chunks(query.order_by(Question.id).yield_per(chunk),
+                         ("id",) + COLUMNS, chunk)
+
+
+def export_categories():
+    '''
+    This function streams every category
+    Returns:
+      - generator of NDJSON chunks, UTF-8 bytes
+    '''
+    query = db.session.query(Category.id, Category.type).order_by(Category.id)
+    return ndjson_chunks(query, ("id", "type"), EXPORT_CHUNK)
+
+
+def ndjson_chunks(rows, columns, chunk):
+    lines = []
+    for row in rows:
+        lines.append(dumps(dict(zip(columns, row))))
+        if len(lines) == chunk:
+            yield b"".join(lines)
+            lines = []
+    if lines:
+        yield b"".join(lines)
@@ -0,0 +1,62 @@
+'''
+`flask` command line commands, run from the backend folder with
+FLASK_APP=flaskr, e.g.
+    flask import-questions content_pack.ndjson
+'''
+import click
+
+from models import reconcile_question_counts
+from .bulk import (import_questions, export_questions, export_categories,
+                   BATCH_SIZE, READERS)
+
+
+def register_commands(app):
+
+    @app.cli.command("import-questions")
+    @click.argument("source", type=click.File("r", encoding="utf-8"))
+    @click.option("--format", "format_", type=click.Choice(sorted(READERS)),
+                  help="Defaults to the file extension, NDJSON otherwise.")
+    @click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+    def import_questions_command(source, format_, batch_size):
+        '''
+        Imports the questions of an NDJSON or CSV file, - reads standard input
+        '''
+        if format_ is None:
+            format_ = "csv" if source.name.endswith(".csv") else "ndjson"
+        report = import_questions(source, format_, batch_size)
+        for error in report["errors"]:
+            click.echo("line {line}: {error}".format(**error), err=True)
+        click.echo("imported {imported} questions in {batches} batches, rejected {rejected}, "
+                   "{seconds}s ({rows_per_second} rows/s)".format(**report))
+
+    @app.cli.command("export-questions")
+    @click.option("--output", type=click.File("wb"), default="-",
+                  help="File to write, standard output by default.")
+    @click.option("--category", type=int)
+    @click.option("--difficulty", type=int)
+    def export_questions_command(output, category, difficulty):
+        '''
+        Writes every question as NDJSON, in the format import-questions reads
+        '''
+        for chunk in export_questions(category, difficulty):
+            output.write(chunk)
+
+    @app.cli.command("export-categories")
+    @click.option("--output", type=click.File("wb"), default="-",
+                  help="File to write, standard output by default.")
+    def export_categories_command(output):
+        '''
+        Writes every category as NDJSON
+        '''
+        for chunk in export_categories():
+            output.write(chunk)
+
+    @app.cli.command("recount-questions")
+    def recount_questions_command():
+        '''
+        Recounts the questions into the per-category and total counters
+        '''
+        wrong = reconcile_question_counts()
+        for category, (counter, count) in sorted(wrong.items()):
+            click.echo("category {}: counter {}, counted {}".format(category, counter, count))
+        click.echo("fixed {} counters".format(len(wrong)))
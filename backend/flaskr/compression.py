@@ -0,0 +1,58 @@
+'''
+Response compression.
+
+Responses of at least COMPRESS_MIN_SIZE bytes are compressed with the
+best encoding the client accepts: brotli when the brotli package is
+installed (`pip install brotli`), else gzip. Streamed responses, like the
+exports, are sent as they are. A compressed response's ETag becomes weak,
+If-None-Match already compares tags weakly.
+'''
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = ("application/json", "application/x-ndjson", "text/plain")
+GZIP_LEVEL = 6
+# brotli's highest qualities cost far more CPU than they save bytes
+BROTLI_QUALITY = 5
+
+ENCODERS = {"gzip": lambda data, app: gzip.compress(
+    data, app.config.get("COMPRESS_GZIP_LEVEL", GZIP_LEVEL))}
+if brotli is not None:
+    ENCODERS["br"] = lambda data, app: brotli.compress(
+        data, quality=app.config.get("COMPRESS_BROTLI_QUALITY", BROTLI_QUALITY))
+
+# preferred first
+ENCODINGS = [encoding for encoding in ("br", "gzip") if encoding in ENCODERS]
+
+
+def init_compression(app):
+    '''
+    This function compresses the large responses of the app
+    '''
+
+    @app.after_request
+    def compress(response):
+        if response.direct_passthrough or response.is_streamed \
+                or response.status_code < 200 or response.status_code >= 300 \
+                or response.mimetype not in COMPRESS_MIMETYPES \
+                or "Content-Encoding" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        data = response.get_data()
+        if encoding is None or len(data) < app.config.get("COMPRESS_MIN_SIZE", COMPRESS_MIN_SIZE):
+            return response
+
+        response.set_data(ENCODERS[encoding](data, app))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
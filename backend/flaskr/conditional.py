@@ -0,0 +1,89 @@
+'''
+HTTP conditional requests for the read endpoints.
+
+The ETag of a response is derived from the URL and the write counters of
+the tables it reads (models.table_versions), so whether a client's copy
+is still current is known before the view runs: a matching If-None-Match
+(or an If-Modified-Since after the last write) is answered with 304
+without running the view or encoding JSON. The counters are kept in the
+database for every process, so all workers send the same tag for the
+same content; a worker reads them at most every DB_TABLE_VERSION_INTERVAL
+seconds, and right after its own writes.
+
+With a shared snapshot (flaskr.snapshot) the questions are served from
+the snapshot, which follows the writes a moment later and may hold the
+writes of other processes, so the tag and the date of the questions
+come from the snapshot mapped instead.
+'''
+import functools
+import hashlib
+import math
+from datetime import datetime, timezone
+
+from flask import current_app, request, make_response
+from models import table_versions
+
+
+def snapshot_version():
+    '''
+    returns the version and export time of the snapshot the questions are served from,
+    None when they are read from the database
+    '''
+    index = current_app.extensions.get("question_index")
+    if index is None or not index.holds_rows:
+        return None
+    index.rebuild_if_due()
+    snapshot = index.snapshot
+    return "{}@{}".format(snapshot.version, snapshot.exported_at), snapshot.exported_at
+
+
+def current_etag(tables, snapshot=None):
+    versions = ",".join(
+        "{}={}".format(table, snapshot[0] if snapshot is not None and table == "questions"
+                       else table_versions.version(table))
+        for table in tables)
+    # no process id in the tag, every worker sends the same one for the same content
+    key = "{}|{}".format(versions, request.full_path)
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def not_modified(etag, modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is None:
+        return False
+    return modified <= since.replace(tzinfo=timezone.utc).timestamp()
+
+
+def conditional(*tables):
+    '''
+    This decorator adds ETag and Last-Modified to the successful responses of
+    a GET view that only reads the given tables, and answers revalidations with 304
+    '''
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            table_versions.refresh()
+            snapshot = snapshot_version() if "questions" in tables else None
+            etag = current_etag(tables, snapshot)
+            modified = table_versions.modified(*tables)
+            if snapshot is not None:
+                modified = max(snapshot[1], table_versions.modified(
+                    *[table for table in tables if table != "questions"]))
+            if not_modified(etag, modified):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # HTTP dates have whole seconds, round up so the date isn't
+            # earlier than the write
+            response.last_modified = datetime.fromtimestamp(
+                math.ceil(modified), timezone.utc)
+            # always revalidate, the tag makes that cheap
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,212 @@
+'''
+Per-request metrics, served at /metrics in the Prometheus text format.
+
+Every request records its latency, the number of SQL statements it ran
+and their time (from SQLAlchemy engine events, replicas included) and the
+time spent encoding JSON (timed by serialization.dumps), labelled by route, method and status. A request
+that runs more statements than METRICS_QUERY_BUDGET is logged with the
+statement it repeated most, the usual sign of an N+1 query.
+
+The histograms live in the process, each worker serves its own.
+'''
+import collections
+import logging
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import HTTPException
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# statements a request may run before it is logged
+QUERY_BUDGET = 20
+
+
+class Histogram:
+    '''
+    Cumulative buckets, sum and count per label values
+    '''
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} histogram".format(self.name)]
+        for label_values, series in sorted(self._series.items()):
+            labels = render_labels(self.labels, label_values)
+            for bound, count in zip(self.buckets, series):
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(
+                    self.name, labels + "," if labels else "", bound, count))
+            lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(
+                self.name, labels + "," if labels else "", series[-1]))
+            lines.append("{}_sum{{{}}} {}".format(self.name, labels, series[-2]))
+            lines.append("{}_count{{{}}} {}".format(self.name, labels, series[-1]))
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = collections.Counter()
+
+    def inc(self, *label_values):
+        self._series[label_values] += 1
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} counter".format(self.name)]
+        for label_values, count in sorted(self._series.items()):
+            lines.append("{}{{{}}} {}".format(
+                self.name, render_labels(self.labels, label_values), count))
+        return lines
+
+
+def render_labels(names, values):
+    return ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+class Metrics:
+
+    def __init__(self):
+        labels = ("route", "method", "status")
+        self.latency = Histogram(
+            "trivia_request_duration_seconds", "Time to build the response.",
+            labels, LATENCY_BUCKETS)
+        self.queries = Histogram(
+            "trivia_request_sql_statements", "SQL statements run by a request.",
+            labels, QUERY_BUCKETS)
+        self.sql_time = Histogram(
+            "trivia_request_sql_seconds", "Time a request spent in SQL statements.",
+            labels, LATENCY_BUCKETS)
+        self.json_time = Histogram(
+            "trivia_request_json_seconds", "Time a request spent encoding JSON.",
+            labels, LATENCY_BUCKETS)
+        self.over_budget = Counter(
+            "trivia_query_budget_exceeded_total",
+            "Requests that ran more SQL statements than the budget.", ("route", "method"))
+        self.errors = Counter(
+            "trivia_handled_errors_total",
+            "Exceptions turned into an error response.", ("route", "status", "exception"))
+        self._lock = threading.Lock()
+
+    def record(self, labels, seconds, queries, sql_seconds, json_seconds):
+        with self._lock:
+            self.latency.observe(seconds, *labels)
+            self.queries.observe(queries, *labels)
+            self.sql_time.observe(sql_seconds, *labels)
+            self.json_time.observe(json_seconds, *labels)
+
+    def record_over_budget(self, route, method):
+        with self._lock:
+            self.over_budget.inc(route, method)
+
+    def record_error(self, route, status, exception):
+        with self._lock:
+            self.errors.inc(route, status, exception)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.latency, self.queries, self.sql_time, self.json_time,
+                           self.over_budget, self.errors):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    if has_request_context() and "request_started" in g:
+        g.sql_seconds += seconds
+        g.sql_statements[statement] += 1
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def init_metrics(app):
+    '''
+    This function records the metrics of every request of the app and serves them at /metrics
+    '''
+    metrics = app.extensions["metrics"] = Metrics()
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.sql_seconds = 0.0
+        g.sql_statements = collections.Counter()
+        g.json_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if "request_started" not in g:
+            return response
+        seconds = time.perf_counter() - g.request_started
+        route = route_label()
+        queries = sum(g.sql_statements.values())
+        metrics.record((route, request.method, response.status_code),
+                       seconds, queries, g.sql_seconds, g.json_seconds)
+
+        budget = app.config.get("METRICS_QUERY_BUDGET", QUERY_BUDGET)
+        if queries > budget:
+            statement, repeats = g.sql_statements.most_common(1)[0]
+            metrics.record_over_budget(route, request.method)
+            app.logger.warning(
+                "%s %s ran %d SQL statements (budget %d), %d times: %s",
+                request.method, request.full_path.rstrip("?"), queries, budget, repeats,
+                " ".join(statement.split())[:300])
+        return response
+
+    @app.route("/metrics")
+    def metrics_view():
+        '''
+        This function serves the request metrics in the Prometheus text format
+        '''
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def record_error(error):
+    '''
+    This function logs the exception an error response was made from, the
+    routes turn unexpected exceptions into 404, 422 or 500 responses
+    '''
+    cause = error.__context__
+    if cause is None or isinstance(cause, HTTPException):
+        return
+    route = route_label()
+    metrics = current_app.extensions.get("metrics")
+    if metrics is not None:
+        metrics.record_error(route, error.code, type(cause).__name__)
+    current_app.logger.log(
+        logging.ERROR if error.code >= 500 else logging.INFO,
+        "%s %s answered %d after %s: %s", request.method, request.full_path.rstrip("?"),
+        error.code, type(cause).__name__, cause,
+        exc_info=(type(cause), cause, cause.__traceback__))
@@ -0,0 +1,275 @@
+'''
+In-process index of the question ids by category and difficulty.
+
+Quiz rounds and the difficulty filter of the category listings keep
+asking which ids exist in a category, at a difficulty. The index answers
+that without a query: one sorted array of 4-byte ids per (category,
+difficulty), about 4.3 MB per million questions whatever the number of
+categories (python -m benchmarks.bench_question_index). The rows of the
+chosen ids are then fetched by primary key in one query.
+
+The index is built when the app starts and kept up to date from the
+Question write hooks of this process. Every RECONCILE_INTERVAL seconds
+(QUESTION_INDEX_RECONCILE_INTERVAL in the app config) it is rebuilt from
+the database in a background thread, which picks up the writes of other
+processes; an import, whose new ids aren't known, or an id found missing
+starts a rebuild at once. QUESTION_INDEX=False turns the index off and
+the routes query the database instead.
+'''
+import bisect
+import heapq
+import itertools
+import random
+import threading
+import time
+from array import array
+
+from flask import current_app, has_app_context
+from models import Question, db, question_listeners, question_rows, QUESTION_FIELDS
+
+RECONCILE_INTERVAL = 60
+# random draws per question wanted before the remaining ids are listed
+DRAWS_PER_QUESTION = 4
+
+
+def descending(ids, end):
+    for position in range(end - 1, -1, -1):
+        yield ids[position]
+
+
+def newest_ids(sequences, offset, limit, before_id=None):
+    '''
+    This function merges ascending sequences of ids into the newest first, skipping
+    `offset` ids or starting below `before_id`, without copying the sequences
+    '''
+    ends = [bisect.bisect_left(ids, before_id) if before_id is not None else len(ids)
+            for ids in sequences]
+    if len(sequences) == 1:
+        end = ends[0] - offset
+        return [sequences[0][position] for position in range(end - 1, max(0, end - limit) - 1, -1)]
+    merged = heapq.merge(*[descending(ids, end) for ids, end in zip(sequences, ends)],
+                         reverse=True)
+    return list(itertools.islice(merged, offset, offset + limit))
+
+
+def sample_ids(sequences, exclude, count):
+    '''
+    This function draws up to `count` distinct random ids out of the sequences, none of them in `exclude`
+    '''
+    exclude = set(exclude)
+    picked = []
+    sizes = [len(ids) for ids in sequences]
+    total = sum(sizes)
+    for _ in range(count * DRAWS_PER_QUESTION):
+        if len(picked) == count or not total:
+            break
+        position = random.randrange(total)
+        for ids, size in zip(sequences, sizes):
+            if position < size:
+                break
+            position -= size
+        if ids[position] not in exclude:
+            exclude.add(ids[position])
+            picked.append(ids[position])
+    if len(picked) < count and total:
+        # most of the ids were excluded, draw from the rest
+        rest = [question_id for ids in sequences for question_id in ids
+                if question_id not in exclude]
+        picked += random.sample(rest, min(count - len(picked), len(rest)))
+    return picked
+
+
+class QuestionIndex:
+    '''
+    Maps (category, difficulty) to the sorted array of the ids of its questions
+    '''
+
+    # the rows of the questions are read from the database
+    holds_rows = False
+
+    def __init__(self, app, interval=RECONCILE_INTERVAL):
+        self.app = app
+        self.interval = interval
+        self.url = None         # database the index was built from
+        self.built_at = 0
+        self.builds = 0
+        self.stale = False
+        self._ids = {}
+        self._changes = None    # writes seen while a rebuild reads the table
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        '''
+        This function reads the ids of every question from scratch, in the app context
+        '''
+        with self._lock:
+            self._changes = []
+        ids = {}
+        for question_id, category, difficulty in db.session.query(
+                Question.id, Question.category, Question.difficulty).order_by(
+                Question.id).yield_per(50000):
+            # a legacy database keeps the category as text, e.g. "2"
+            key = tuple(None if value is None else int(value) for value in (category, difficulty))
+            if key not in ids:
+                ids[key] = array("i")
+            ids[key].append(question_id)
+        with self._lock:
+            self._ids = ids
+            self.stale = False
+            # the table was read while these were written, replaying them
+            # is harmless for the ones it already saw
+            for action, questions in self._changes:
+                self._update(action, questions)
+            self._changes = None
+            self.url = str(db.engine.url)
+            self.built_at = time.time()
+            self.builds += 1
+
+    def rebuild_if_due(self):
+        '''
+        This function rebuilds the index at once when the app was bound to
+        another database since, in the background when it is stale or old
+        '''
+        if self.url != str(db.engine.url):
+            self.rebuild()
+            return
+        if not self.stale and (not self.interval or time.time() - self.built_at < self.interval):
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            with self.app.app_context():
+                self.rebuild()
+        except Exception:
+            self.app.logger.exception("rebuilding the question index failed")
+        finally:
+            self._rebuilding = False
+
+    def update(self, action, questions):
+        '''
+        This function applies the questions an action wrote
+        '''
+        if action == "import":
+            self.stale = True
+            return
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((action, questions))
+            self._update(action, questions)
+
+    def count(self, category=0, difficulty=None):
+        with self._lock:
+            return sum(len(ids) for ids in self._arrays(category, difficulty))
+
+    def newest(self, category, difficulty, offset, limit, before_id=None):
+        '''
+        This function lists the ids of the category (0 for all of them) at the difficulty
+        (None for any), newest first, skipping `offset` ids or starting below `before_id`
+        '''
+        with self._lock:
+            return newest_ids(self._arrays(category, difficulty), offset, limit, before_id)
+
+    def sample(self, category, difficulty, exclude, count):
+        '''
+        This function draws up to `count` distinct random ids of the category
+        (0 for all of them) at the difficulty (None for any), none of them in `exclude`
+        '''
+        with self._lock:
+            return sample_ids(self._arrays(category, difficulty), exclude, count)
+
+    def questions(self, ids, fields=QUESTION_FIELDS):
+        '''
+        This function fetches the questions of the ids in one query, in the order of the ids,
+        marking the index stale when some of them no longer exist
+        '''
+        if not ids:
+            return []
+        rows = {row['id']: row for row in question_rows(
+            Question.query.filter(Question.id.in_(ids)), fields)}
+        if len(rows) < len(ids):
+            self.stale = True
+        return [rows[question_id] for question_id in ids if question_id in rows]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "questions": sum(len(ids) for ids in self._ids.values()),
+                "keys": len(self._ids),
+                "bytes": sum(ids.buffer_info()[1] * ids.itemsize for ids in self._ids.values()),
+                "builds": self.builds,
+                "built_at": self.built_at,
+                "stale": self.stale,
+            }
+
+    def _arrays(self, category, difficulty):
+        return [ids for (key_category, key_difficulty), ids in self._ids.items()
+                if (category == 0 or key_category == category)
+                and (difficulty is None or key_difficulty == difficulty)]
+
+    def _update(self, action, questions):
+        try:
+            self._apply(self._ids, action, questions)
+        except (TypeError, ValueError):
+            # values the database converted but we can't, ask it
+            self.stale = True
+
+    @staticmethod
+    def _apply(index, action, questions):
+        for question in questions:
+            question_id = question['id']
+            if action in ("update", "delete"):
+                # an update doesn't tell where the question was before
+                for ids in index.values():
+                    position = bisect.bisect_left(ids, question_id)
+                    if position < len(ids) and ids[position] == question_id:
+                        del ids[position]
+            if action in ("insert", "update"):
+                # the values are written as they were sent, e.g. "2"
+                key = tuple(None if value is None else int(value)
+                            for value in (question['category'], question['difficulty']))
+                if key not in index:
+                    index[key] = array("i")
+                ids = index[key]
+                position = bisect.bisect_left(ids, question_id)
+                if position == len(ids) or ids[position] != question_id:
+                    ids.insert(position, question_id)
+
+
+def init_question_index(app):
+    '''
+    This function builds the question index of the app, unless QUESTION_INDEX is False
+    '''
+    if not app.config.get("QUESTION_INDEX", True):
+        return
+    index = QuestionIndex(app, app.config.get(
+        "QUESTION_INDEX_RECONCILE_INTERVAL", RECONCILE_INTERVAL))
+    with app.app_context():
+        index.rebuild()
+    app.extensions["question_index"] = index
+
+
+def question_index():
+    '''
+    This function returns the question index of the current app, None when it is turned off
+    '''
+    index = current_app.extensions.get("question_index")
+    if index is not None:
+        index.rebuild_if_due()
+    return index
+
+
+def update_question_index(action, questions):
+    if not has_app_context():
+        return
+    index = current_app.extensions.get("question_index")
+    if index is not None:
+        index.update(action, questions)
+
+
+question_listeners.append(update_question_index)
@@ -0,0 +1,122 @@
+'''
+Random question selection for the quiz rounds.
+
+Instead of loading every unseen question of the category and calling
+random.choice on the list, a random id between the category's lowest and
+highest id is drawn and the first question at or after it is fetched
+with an index seek. Hits on the previous questions are retried with a new
+pivot, so a turn costs a handful of single-row queries whatever the size
+of the category or the length of the round. Several questions are drawn
+with one pivot each, all sought in the same query.
+
+Ids following a gap in the sequence are a little more likely to be drawn,
+which is fine for a quiz.
+'''
+import random
+
+from sqlalchemy import select, union_all
+
+from models import Question, db, QUESTION_FIELDS
+
+# draws tried before falling back to skipping the seen ids in SQL
+PICK_ATTEMPTS = 8
+# questions a single /quizzes request may ask for
+MAX_QUIZ_BATCH = 20
+
+
+def category_query(category, difficulty=None):
+    '''
+    This function builds the query of the questions a round draws from,
+    category 0 stands for all the categories, difficulty None for all the difficulties
+    '''
+    query = Question.query
+    if category != 0:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query
+
+
+def batch_count(data):
+    '''
+    This function reads the number of questions asked for at once from the `count` of a /quizzes body
+    Returns:
+      - the count, None without it, raises ValueError unless it is between 1 and MAX_QUIZ_BATCH
+    '''
+    count = data.get('count') if isinstance(data, dict) else None
+    if count is None:
+        return None
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_QUIZ_BATCH:
+        raise ValueError("count must be between 1 and {}".format(MAX_QUIZ_BATCH))
+    return count
+
+
+def pick_questions(category, previous_questions, count=1, difficulty=None, attempts=PICK_ATTEMPTS):
+    '''
+    This function picks up to count distinct random questions within the category that are not in previous_questions,
+    the seeks of all the pivots of a draw are sent as one UNION ALL query
+    Returns:
+      - the formatted questions, fewer than count (none) when the round runs out of questions
+    '''
+    query = category_query(category, difficulty).with_entities(
+        *[getattr(Question, field) for field in QUESTION_FIELDS])
+    # two queries, so each bound is a single index seek
+    low = query.with_entities(db.func.min(Question.id)).scalar()
+    if low is None:
+        return []
+    high = query.with_entities(db.func.max(Question.id)).scalar()
+
+    seen = set(previous_questions)
+    picked = {}
+
+    def keep(rows):
+        for row in rows:
+            if row[0] not in seen and row[0] not in picked:
+                picked[row[0]] = dict(zip(QUESTION_FIELDS, row))
+
+    for _ in range(attempts):
+        wanted = count - len(picked)
+        if not wanted:
+            return list(picked.values())
+        seeks = [select([query.filter(Question.id >= random.randint(low, high)).order_by(
+            Question.id).limit(1).subquery()]) for _ in range(wanted)]
+        keep(db.session.execute(union_all(*seeks)))
+
+    # most of the category was already asked, let the database skip the
+    # seen ids while seeking from a last pivot, wrapping around once
+    wanted = count - len(picked)
+    if wanted:
+        skipped = seen | set(picked)
+        if skipped:
+            query = query.filter(Question.id.notin_(skipped))
+        pivot = random.randint(low, high)
+        rows = query.filter(Question.id >= pivot).order_by(Question.id).limit(wanted).all()
+        if len(rows) < wanted:
+            rows += query.filter(Question.id < pivot).order_by(
+                db.desc(Question.id)).limit(wanted - len(rows)).all()
+        keep(rows)
+    return list(picked.values())
+
+
+def sample_questions(index, category, previous_questions, count=1, difficulty=None,
+                     attempts=PICK_ATTEMPTS):
+    '''
+    This function draws the questions from the ids of the question index, drawing again
+    for the ids another process deleted since, and picks the rest from the database
+    when they keep missing
+    Returns:
+      - the formatted questions, fewer than count (none) when the round runs out of questions
+    '''
+    exclude = set(previous_questions)
+    questions = []
+    for _ in range(attempts):
+        ids = index.sample(category, difficulty, exclude, count - len(questions))
+        if not ids:
+            return questions
+        found = index.questions(ids)
+        questions += found
+        exclude.update(ids)
+        if len(questions) == count:
+            return questions
+    return questions + pick_questions(
+        category, exclude, count - len(questions), difficulty)
@@ -0,0 +1,96 @@
+'''
+Server-side quiz sessions.
+
+A session shuffles the ids of its category once when the round starts
+and then hands out one id per turn, so a turn is a pop from an array and
+a primary-key lookup, and the client no longer sends previous_questions.
+
+Decks are kept as array('i') (4 bytes per question). Any object with the
+same create / next_id / delete methods as MemorySessionStore can be
+passed as QUIZ_SESSION_STORE in the app config to share sessions between
+processes.
+'''
+import random
+import threading
+import time
+import uuid
+from array import array
+
+from models import Question
+
+# seconds an idle session is kept
+SESSION_TTL = 30 * 60
+# sessions kept in memory before the least recently used one is dropped
+MAX_SESSIONS = 10000
+
+
+class MemorySessionStore:
+    '''
+    Keeps the decks in this process, evicting sessions idle for longer than ttl
+    '''
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}   # session id -> [deck, expires at]
+        self._lock = threading.Lock()
+
+    def create(self, ids):
+        '''
+        This function stores a new deck
+        Returns:
+          - the session id
+        '''
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            self._sessions[session_id] = [array('i', ids), now + self.ttl]
+        return session_id
+
+    def next_id(self, session_id):
+        '''
+        This function takes the next question id off the deck
+        Returns:
+          - the id, None when the deck is used up
+          - raises KeyError for unknown or expired sessions
+        '''
+        now = time.time()
+        with self._lock:
+            session = self._sessions[session_id]
+            if session[1] < now:
+                del self._sessions[session_id]
+                raise KeyError(session_id)
+            # refresh the position in the eviction order
+            del self._sessions[session_id]
+            self._sessions[session_id] = session
+            session[1] = now + self.ttl
+            deck = session[0]
+            return deck.pop() if len(deck) else None
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict(self, now):
+        # dicts keep insertion order and sessions move to the end when used,
+        # so the least recently used, and the expired ones, come first
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if self._sessions[oldest][1] >= now and \
+                    len(self._sessions) < self.max_sessions:
+                break
+            del self._sessions[oldest]
+
+
+def shuffled_deck(query, size=None):
+    '''
+    This function loads the ids of the given question query once and shuffles them
+    Returns:
+      - array of question ids, the last one is asked first
+    '''
+    ids = array('i', (row[0] for row in query.with_entities(Question.id)))
+    random.shuffle(ids)
+    if size is not None and size < len(ids):
+        ids = ids[len(ids) - size:]
+    return ids
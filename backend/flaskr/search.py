@@ -0,0 +1,328 @@
+'''
+Full-text search over the question and answer of every question.
+
+On PostgreSQL the search runs against the generated `search_vector`
+column and its GIN index (see migrations.search_vector), ranked with
+ts_rank. Other databases, SQLite in tests and benchmarks, fall back to an
+in-process inverted index that is built on the first search and kept up
+to date from the Question write hooks.
+
+Every word of the search term has to match the start of a word in the
+question or the answer, so "pain" finds "painting". Matches in the
+question rank above matches in the answer.
+
+The pages found are kept in a SearchCache, keyed by the lowercased,
+trimmed term and the page, so a popular search is answered from memory.
+A page is dropped once a question was written (the questions version of
+models.table_versions moved, at once for writes through this process,
+within DB_TABLE_VERSION_INTERVAL seconds for the others) or after
+SEARCH_CACHE_TTL seconds; the least recently used pages go first past
+SEARCH_CACHE_SIZE pages or SEARCH_CACHE_BYTES of text.
+'''
+import bisect
+import heapq
+import re
+import threading
+import time
+from array import array
+
+from flask import current_app, has_app_context
+from models import Question, db, question_listeners, question_rows, table_versions
+
+WORD = re.compile(r"\w+", re.UNICODE)
+# a word in the question counts this much more than one in the answer
+QUESTION_WEIGHT = 2
+SEARCH_CACHE_TTL = 60
+SEARCH_CACHE_SIZE = 10000
+SEARCH_CACHE_BYTES = 32 * 2 ** 20
+# counted for each cached question on top of its text
+QUESTION_OVERHEAD = 200
+
+
+def tokenize(text):
+    return WORD.findall((text or "").lower())
+
+
+class InvertedIndex:
+    '''
+    Maps every word to the ids of the questions it appears in, with a score.
+    Postings are kept as arrays, about 5 bytes per distinct word of a question
+    '''
+
+    def __init__(self):
+        self.built = False
+        self._postings = {}     # word -> (array of question ids, array of scores)
+        self._vocabulary = []   # sorted words, for prefix lookups
+        self._lock = threading.Lock()
+
+    def build(self, rows):
+        '''
+        This function indexes (id, question, answer) rows from scratch
+        '''
+        with self._lock:
+            self._postings = {}
+            for question_id, question, answer in rows:
+                self._add(question_id, question, answer)
+            self._vocabulary = sorted(self._postings)
+            self.built = True
+
+    def add(self, question_id, question, answer):
+        with self._lock:
+            self._add(question_id, question, answer)
+
+    def remove(self, question_id, question, answer):
+        '''
+        This function drops a question, its text tells which postings hold it
+        '''
+        with self._lock:
+            for word in set(tokenize(question) + tokenize(answer)):
+                ids, scores = self._postings.get(word, ((), ()))
+                if question_id in ids:
+                    position = ids.index(question_id)
+                    del ids[position]
+                    del scores[position]
+
+    def search(self, term, limit):
+        '''
+        This function finds the questions matching every word of the term
+        Returns:
+          - ids of the best `limit` matches, best first
+        '''
+        words = tokenize(term)
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = sorted(self._postings)
+            postings = sorted((self._prefix_postings(word) for word in words),
+                              key=lambda lists: sum(len(ids) for ids, _ in lists))
+            if not postings:
+                return []
+            if len(postings) == 1 and len(postings[0]) == 1:
+                return top_postings(*postings[0][0], limit)
+            # start from the rarest word, the others only filter and add up
+            matches = {}
+            for ids, scores in postings[0]:
+                for question_id, score in zip(ids, scores):
+                    matches[question_id] = matches.get(question_id, 0) + score
+            for lists in postings[1:]:
+                found = {}
+                for ids, scores in lists:
+                    for question_id, score in zip(ids, scores):
+                        if question_id in matches:
+                            found[question_id] = found.get(
+                                question_id, matches[question_id]) + score
+                matches = found
+                if not matches:
+                    return []
+        best = heapq.nlargest(limit, matches.items(),
+                              key=lambda item: (item[1], item[0]))
+        return [question_id for question_id, _ in best]
+
+    def _prefix_postings(self, prefix):
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + "\uffff", start)
+        return [self._postings[word] for word in vocabulary[start:end]]
+
+    def _add(self, question_id, question, answer):
+        counts = {}
+        for word in tokenize(question):
+            counts[word] = counts.get(word, 0) + QUESTION_WEIGHT
+        for word in tokenize(answer):
+            counts[word] = counts.get(word, 0) + 1
+        for word, score in counts.items():
+            if word not in self._postings:
+                self._postings[word] = (array("i"), array("B"))
+                self._vocabulary = None
+            ids, scores = self._postings[word]
+            # kept in increasing id order, top_postings relies on it
+            position = bisect.bisect_left(ids, question_id)
+            ids.insert(position, question_id)
+            scores.insert(position, min(score, 255))
+
+
+def top_postings(ids, scores, limit):
+    '''
+    This function picks the best `limit` entries of one posting list without
+    walking it in Python: ids are kept in increasing order, so searching
+    the scores from the end for each score, highest first, yields the same
+    order as ranking by (score, id)
+    '''
+    raw = scores.tobytes()
+    best = []
+    for score in range(max(raw, default=0), 0, -1):
+        end = len(raw)
+        while len(best) < limit:
+            end = raw.rfind(bytes((score,)), 0, end)
+            if end < 0:
+                break
+            best.append(ids[end])
+        if len(best) == limit:
+            break
+    return best
+
+
+def search_index():
+    '''
+    This function returns the inverted index of the current app, building it on first use
+    '''
+    index = current_app.extensions.setdefault("search_index", InvertedIndex())
+    if not index.built:
+        index.build(db.session.query(
+            Question.id, Question.question, Question.answer).order_by(
+            Question.id).yield_per(10000))
+    return index
+
+
+def search_questions(term, page, per_page):
+    '''
+    This function searches the question and answer of every question for the given term
+    Returns:
+      - the formatted questions of the requested page, best match first
+    '''
+    if page < 1:
+        return []
+    start = (page - 1) * per_page
+    words = tokenize(term)
+    if not words:
+        # nothing to rank, an empty search lists every question
+        return question_rows(Question.query.order_by(db.desc(Question.id)).offset(
+            start).limit(per_page))
+
+    if db.engine.dialect.name == "postgresql":
+        tsquery = db.func.to_tsquery(
+            "english", " & ".join(word + ":*" for word in words))
+        vector = db.literal_column("search_vector")
+        return question_rows(Question.query.filter(vector.op("@@")(tsquery)).order_by(
+            db.desc(db.func.ts_rank(vector, tsquery)), db.desc(Question.id)
+        ).offset(start).limit(per_page))
+
+    ids = search_index().search(term, start + per_page)[start:]
+    questions = {question['id']: question for question in
+                 question_rows(Question.query.filter(Question.id.in_(ids)))} if ids else {}
+    return [questions[question_id] for question_id in ids
+            if question_id in questions]
+
+
+class SearchCache:
+    '''
+    Least recently used pages of search results, each tagged with the questions version it was found at
+    '''
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_SIZE,
+                 max_bytes=SEARCH_CACHE_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._pages = {}   # key -> (questions, version, time found, bytes), least recent first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(term, page):
+        return ((term or "").strip().lower(), page)
+
+    def get(self, term, page):
+        '''
+        returns the formatted questions of the page, None when it isn't cached or is out of date
+        '''
+        key = self.key(term, page)
+        with self._lock:
+            cached = self._pages.pop(key, None)
+            if cached is not None and cached[1] == table_versions.version("questions") \
+                    and time.time() - cached[2] < self.ttl:
+                # kept last, so the least recently used pages come first
+                self._pages[key] = cached
+                self.hits += 1
+                return cached[0]
+            if cached is not None:
+                self.bytes -= cached[3]
+            self.misses += 1
+            return None
+
+    def put(self, term, page, questions, version):
+        '''
+        keeps the formatted questions of the page, found at the given questions version
+        '''
+        key = self.key(term, page)
+        size = len(key[0]) + sum(QUESTION_OVERHEAD + len(question['question'] or "")
+                                 + len(question['answer'] or "") for question in questions)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            replaced = self._pages.pop(key, None)
+            if replaced is not None:
+                self.bytes -= replaced[3]
+            while self._pages and (len(self._pages) >= self.max_entries
+                                   or self.bytes + size > self.max_bytes):
+                self.bytes -= self._pages.pop(next(iter(self._pages)))[3]
+            self._pages[key] = (questions, version, time.time(), size)
+            self.bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._pages = {}
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": len(self._pages),
+            "bytes": self.bytes,
+            "ttl": self.ttl
+        }
+
+
+def cached_search(term, page, per_page):
+    '''
+    This function searches like search_questions, answering repeated searches from the search cache of the app
+    Returns:
+      - the formatted questions of the requested page, best match first
+    '''
+    cache = current_app.extensions.get("search_cache")
+    if cache is None:
+        return search_questions(term, page, per_page)
+    table_versions.refresh()
+    questions = cache.get(term, page)
+    if questions is None:
+        # read first, a write during the search then makes the page out of date
+        version = table_versions.version("questions")
+        questions = search_questions(term, page, per_page)
+        cache.put(term, page, questions, version)
+    return questions
+
+
+def init_search_cache(app):
+    '''
+    This function creates the search cache of the app, unless SEARCH_CACHE is False
+    '''
+    if not app.config.get("SEARCH_CACHE", True):
+        return
+    app.extensions["search_cache"] = SearchCache(
+        ttl=app.config.get("SEARCH_CACHE_TTL", SEARCH_CACHE_TTL),
+        max_entries=app.config.get("SEARCH_CACHE_SIZE", SEARCH_CACHE_SIZE),
+        max_bytes=app.config.get("SEARCH_CACHE_BYTES", SEARCH_CACHE_BYTES))
+
+
+def update_search_index(action, questions):
+    if not has_app_context():
+        return
+    index = current_app.extensions.get("search_index")
+    if index is None or not index.built:
+        return
+    if action in ("update", "import"):
+        # the old text or the new ids aren't known, rebuild on the next search
+        index.built = False
+        return
+    for question in questions:
+        if action == "delete":
+            index.remove(question["id"], question["question"], question["answer"])
+        else:
+            index.add(question["id"], question["question"], question["answer"])
+
+
+question_listeners.append(update_search_index)
@@ -0,0 +1,62 @@
+'''
+JSON encoding of the API responses.
+
+Every response body goes through one of SERIALIZERS: the standard
+library's json, or orjson when it is installed (`pip install orjson`),
+several times faster on long lists of questions. Both sort the keys and
+leave out the spaces; orjson writes non-ASCII characters as UTF-8 where
+json escapes them. The JSON_SERIALIZER setting of create_app(), or
+TRIVIA_JSON_SERIALIZER, picks one, the default is the fastest installed.
+'''
+import json
+import os
+import time
+
+from flask import current_app, g, has_app_context, has_request_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(data):
+    return (json.dumps(data, sort_keys=True, separators=(',', ':')) + "\n").encode()
+
+
+SERIALIZERS = {"json": json_dumps}
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+
+    def orjson_dumps(data):
+        return orjson.dumps(data, option=ORJSON_OPTIONS)
+
+    SERIALIZERS["orjson"] = orjson_dumps
+
+DEFAULT_SERIALIZER = os.environ.get(
+    "TRIVIA_JSON_SERIALIZER", "orjson" if orjson is not None else "json")
+
+
+def dumps(data, serializer=None):
+    '''
+    This function encodes the data with the serializer of the current app,
+    adding the time it takes to the request metrics
+    Returns:
+      - JSON bytes ending with a newline
+    '''
+    if serializer is None:
+        serializer = current_app.config.get("JSON_SERIALIZER", DEFAULT_SERIALIZER) \
+            if has_app_context() else DEFAULT_SERIALIZER
+    start = time.perf_counter()
+    body = SERIALIZERS[serializer](data)
+    if has_request_context():
+        g.json_seconds = g.get("json_seconds", 0) + time.perf_counter() - start
+    return body
+
+
+def jsonify(data):
+    '''
+    This function is flask.jsonify for a dict, encoded by dumps()
+    '''
+    return current_app.response_class(dumps(data), mimetype="application/json")
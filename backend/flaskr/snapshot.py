@@ -0,0 +1,312 @@
+'''
+Shared-memory snapshot of the questions, for several worker processes.
+
+With SNAPSHOT_PATH set (in the app config or as TRIVIA_SNAPSHOT_PATH),
+the question index of every worker is one file, memory-mapped read-only:
+the ids, categories and difficulties of the questions as arrays, their
+text and the ids of every (category, difficulty). The category names
+come from the category cache (models.category_cache), which a category
+write clears at once, not from the snapshot. The workers share the pages of the file, so a host holds one copy whatever
+the number of workers, and the listings and quiz rounds are answered
+from it without a database round trip. Put it on a memory file system,
+e.g. /dev/shm/trivia.snapshot.
+
+A snapshot is exported from the database by whichever process gets the
+export lock: the first one to start, then the one that wrote questions,
+or the first to find the snapshot older than SNAPSHOT_REFRESH_INTERVAL
+seconds. It is written to a new file that replaces the old one, every
+worker checks the file before a read and maps the new one when it
+changed, the version in its header counts the exports. Reads keep using
+the snapshot they started with, and see a write once the export that
+follows it is done, a moment later. Needs a POSIX system (fcntl).
+'''
+import bisect
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+from models import Question, db, category_cache, QUESTION_FIELDS
+from .question_index import newest_ids, sample_ids
+
+MAGIC = b"TRIVIAS1"
+HEADER = struct.Struct("<8sQ")
+REFRESH_INTERVAL = 60
+# stored for a NULL category or difficulty
+NULL = -2 ** 31
+
+
+def aligned(offset):
+    return (offset + 7) // 8 * 8
+
+
+def export_snapshot(path):
+    '''
+    This function writes the questions of the current app's database
+    to a new snapshot that replaces the one at path, one process at a time
+    Returns:
+      - the version of the new snapshot
+    '''
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            version = Snapshot.load(path).version + 1
+        except (OSError, ValueError):
+            version = 1
+
+        ids, categories, difficulties = array("i"), array("i"), array("i")
+        offsets, text = array("q", [0]), bytearray()
+        segments = {}
+        for question_id, category, difficulty, question, answer in db.session.query(
+                Question.id, Question.category, Question.difficulty,
+                Question.question, Question.answer).order_by(Question.id).yield_per(50000):
+            # a legacy database keeps the category as text, e.g. "2"
+            category = None if category is None else int(category)
+            difficulty = None if difficulty is None else int(difficulty)
+            segments.setdefault((category, difficulty), array("i")).append(len(ids))
+            ids.append(question_id)
+            categories.append(NULL if category is None else category)
+            difficulties.append(NULL if difficulty is None else difficulty)
+            for value in (question, answer):
+                text += (value or "").encode()
+                offsets.append(len(text))
+
+        # the positions of the rows of each (category, difficulty), one after the other
+        positions, directory = array("i"), []
+        for (category, difficulty), rows in segments.items():
+            directory.append([category, difficulty, len(positions), len(rows)])
+            positions += rows
+
+        sections, data_size = {}, 0
+        blobs = [("ids", ids), ("categories", categories), ("difficulties", difficulties),
+                 ("offsets", offsets), ("positions", positions), ("text", text)]
+        for name, blob in blobs:
+            size = len(blob) * getattr(blob, "itemsize", 1)
+            sections[name] = [data_size, size, getattr(blob, "typecode", "B")]
+            data_size = aligned(data_size + size)
+        header = json.dumps({
+            "version": version,
+            "exported_at": time.time(),
+            "database": str(db.engine.url),
+            "count": len(ids),
+            "segments": directory,
+            "sections": sections,
+        }).encode()
+
+        base = aligned(HEADER.size + len(header))
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as snapshot:
+            snapshot.write(HEADER.pack(MAGIC, len(header)) + header)
+            for name, blob in blobs:
+                snapshot.seek(base + sections[name][0])
+                snapshot.write(blob)
+        # workers that already mapped the old file keep reading it
+        os.replace(temporary, path)
+        return version
+
+
+class Snapshot:
+    '''
+    One mapped snapshot file, its arrays are views of the mapping
+    '''
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as snapshot:
+            stamp = os.fstat(snapshot.fileno())
+            mapping = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size = HEADER.unpack_from(mapping)
+        if magic != MAGIC:
+            raise ValueError("{} is not a question snapshot".format(path))
+        header = json.loads(mapping[HEADER.size:HEADER.size + header_size])
+        base = aligned(HEADER.size + header_size)
+        view = memoryview(mapping)
+        arrays = {name: view[base + offset:base + offset + size].cast(typecode)
+                  for name, (offset, size, typecode) in header["sections"].items()}
+        return cls(header, arrays, (stamp.st_ino, stamp.st_mtime_ns))
+
+    def __init__(self, header, arrays, stamp):
+        self.stamp = stamp
+        self.version = header["version"]
+        self.exported_at = header["exported_at"]
+        self.database = header["database"]
+        self.count = header["count"]
+        self.segments = {(category, difficulty): (start, length)
+                         for category, difficulty, start, length in header["segments"]}
+        self.ids = arrays["ids"]
+        self.categories = arrays["categories"]
+        self.difficulties = arrays["difficulties"]
+        self.offsets = arrays["offsets"]
+        self.positions = arrays["positions"]
+        self.text = arrays["text"]
+
+    def sequences(self, category, difficulty):
+        if category == 0 and difficulty is None:
+            return [self.ids]
+        return [SegmentIds(self.ids, self.positions, start, length)
+                for (key_category, key_difficulty), (start, length) in self.segments.items()
+                if (category == 0 or key_category == category)
+                and (difficulty is None or key_difficulty == difficulty)]
+
+    def row(self, position, fields):
+        values = {
+            "id": self.ids[position],
+            "question": bytes(self.text[self.offsets[2 * position]:
+                                        self.offsets[2 * position + 1]]).decode(),
+            "answer": bytes(self.text[self.offsets[2 * position + 1]:
+                                      self.offsets[2 * position + 2]]).decode(),
+            "category": self.categories[position],
+            "difficulty": self.difficulties[position],
+        }
+        return {field: None if values[field] == NULL else values[field] for field in fields}
+
+
+class SegmentIds:
+    '''
+    The ids of one (category, difficulty) of a snapshot, in increasing order
+    '''
+
+    def __init__(self, ids, positions, start, length):
+        self.ids = ids
+        self.positions = positions
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return self.ids[self.positions[self.start + index]]
+
+
+class SnapshotIndex:
+    '''
+    The question index of a worker in snapshot mode, answering from the mapped snapshot
+    '''
+
+    # the rows of the questions are in the snapshot too
+    holds_rows = True
+
+    def __init__(self, app, path, interval=REFRESH_INTERVAL):
+        self.app = app
+        self.path = path
+        self.interval = interval
+        self.snapshot = None
+        self.loads = 0
+        self.exports = 0
+        self._exporting = False
+        self._pending = False
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        '''
+        This function exports a new snapshot and maps it, in the app context
+        '''
+        export_snapshot(self.path)
+        self.exports += 1
+        self.snapshot = Snapshot.load(self.path)
+        self.loads += 1
+
+    def rebuild_if_due(self):
+        '''
+        This function maps the snapshot again when another process replaced it,
+        exports one at once when there is none for this database yet,
+        and in the background when it is older than the refresh interval
+        '''
+        try:
+            stamp = os.stat(self.path)
+            stamp = (stamp.st_ino, stamp.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if stamp is None or self.snapshot is None or stamp != self.snapshot.stamp:
+            if stamp is None:
+                export_snapshot(self.path)
+            self.snapshot = Snapshot.load(self.path)
+            self.loads += 1
+        if self.snapshot.database != str(db.engine.url):
+            # the app was bound to another database since
+            export_snapshot(self.path)
+            self.snapshot = Snapshot.load(self.path)
+            self.loads += 1
+        elif self.interval and time.time() - self.snapshot.exported_at >= self.interval:
+            self.export_in_background()
+
+    def update(self, action, questions):
+        self.export_in_background()
+
+    def export_in_background(self):
+        with self._lock:
+            if self._exporting:
+                # the running export may have read the table before the write
+                self._pending = True
+                return
+            self._exporting = True
+            self._pending = False
+        threading.Thread(target=self._export, daemon=True).start()
+
+    def _export(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    export_snapshot(self.path)
+                self.exports += 1
+            except Exception:
+                self.app.logger.exception("exporting the question snapshot failed")
+            with self._lock:
+                if not self._pending:
+                    self._exporting = False
+                    return
+                self._pending = False
+
+    def count(self, category=0, difficulty=None):
+        snapshot = self.snapshot
+        return sum(len(ids) for ids in snapshot.sequences(category, difficulty))
+
+    def newest(self, category, difficulty, offset, limit, before_id=None):
+        return newest_ids(self.snapshot.sequences(category, difficulty), offset, limit, before_id)
+
+    def sample(self, category, difficulty, exclude, count):
+        return sample_ids(self.snapshot.sequences(category, difficulty), exclude, count)
+
+    def questions(self, ids, fields=QUESTION_FIELDS):
+        snapshot = self.snapshot
+        rows = []
+        for question_id in ids:
+            position = bisect.bisect_left(snapshot.ids, question_id)
+            if position < snapshot.count and snapshot.ids[position] == question_id:
+                rows.append(snapshot.row(position, fields))
+        return rows
+
+    def category_map(self):
+        # the snapshot follows question writes only
+        return dict(category_cache.all())
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            "path": self.path,
+            "version": snapshot.version,
+            "exported_at": snapshot.exported_at,
+            "questions": snapshot.count,
+            "bytes": os.path.getsize(self.path),
+            "loads": self.loads,
+            "exports": self.exports,
+        }
+
+
+def init_snapshot(app, path):
+    '''
+    This function maps the question snapshot at path as the question index of the app,
+    exporting it first when there is none
+    '''
+    index = SnapshotIndex(app, path, app.config.get(
+        "SNAPSHOT_REFRESH_INTERVAL", REFRESH_INTERVAL))
+    with app.app_context():
+        index.rebuild_if_due()
+    app.extensions["question_index"] = index
@@ -0,0 +1,52 @@
+'''
+Rules every new question has to follow, shared by POST /questions and
+the bulk import.
+'''
+import math
+
+
+def whole_number(value, name):
+    '''
+    This function reads a whole number sent as a number or a string of digits
+    Returns:
+      - the number, raises ValueError for anything else
+    '''
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    # JSON parsers accept Infinity and NaN, which int() can't convert
+    if isinstance(value, (int, float)) and not isinstance(value, bool) \
+            and math.isfinite(value) and value == int(value):
+        return int(value)
+    raise ValueError("{} must be a whole number".format(name))
+
+
+def validate_question(data, categories=None):
+    '''
+    This function checks the submitted values of a new question
+    Returns:
+      - question, answer, difficulty and category, with leading and trailing spaces removed
+        and the difficulty and category as integers
+      - raises ValueError if a value is missing, empty, not a whole number,
+        or the category isn't one of `categories` (not checked when None)
+    '''
+    try:
+        # using 'strip' to remove any leading or trailing spaces
+        question_data = {"question": data['question'].strip(),
+                         "answer": data['answer'].strip(),
+                         "difficulty": data['difficulty'],
+                         "category": data['category']
+                         }
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError("question, answer, difficulty and category are required")
+
+    # check if the question and answer both are not left empty
+    if question_data['question'] == "" or question_data['answer'] == "":
+        raise ValueError("question and answer can't be empty")
+    if question_data['category'] in (None, "") or question_data['difficulty'] in (None, ""):
+        raise ValueError("category and difficulty can't be empty")
+    # a value the column can't hold would fail the whole batch it is written with
+    question_data['difficulty'] = whole_number(question_data['difficulty'], "difficulty")
+    question_data['category'] = whole_number(question_data['category'], "category")
+    if categories is not None and question_data['category'] not in categories:
+        raise ValueError("unknown category {}".format(question_data['category']))
+    return question_data
@@ -0,0 +1,202 @@
+'''
+Write-behind group commit for POST /questions.
+
+Every question added through POST /questions is otherwise its own
+transaction, and at high write rates the commits (an fsync each) take
+most of the time. With WRITE_BEHIND=True in the app config the route
+puts the question on a queue instead, and one background thread writes
+what is queued in a single transaction: up to WRITE_BEHIND_BATCH_SIZE
+questions, waiting at most WRITE_BEHIND_MAX_DELAY seconds after the
+first one for others to join it. The default delay is 0, the questions
+queued while one transaction commits make the next one, so a lone
+writer isn't kept waiting (python -m benchmarks.bench_write_behind).
+
+WRITE_BEHIND_ACK picks when the route answers:
+  - "commit" (default) once the transaction holding the question
+    committed, with its id; the question is as durable as with the
+    per-row path, only a little later
+  - "queued" as soon as it is queued, with 202 and no id; questions
+    still queued are lost if the process dies
+A request that finds WRITE_BEHIND_QUEUE_SIZE questions queued is answered
+503. When a transaction fails, its questions are written again one at a
+time, so one bad question only fails its own request.
+'''
+import atexit
+import queue
+import threading
+import time
+
+from models import Question, db, notify_question_listeners
+
+BATCH_SIZE = 100
+MAX_DELAY = 0
+QUEUE_SIZE = 10000
+ACKS = ("commit", "queued")
+# seconds a request waits for its commit before giving up on an answer
+ACK_TIMEOUT = 10
+
+
+class PendingQuestion:
+    '''
+    A queued question, done once it was written or failed
+    '''
+
+    def __init__(self, values):
+        self.values = values
+        self.id = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, question_id=None, error=None):
+        self.id = question_id
+        self.error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        '''
+        This function waits for the question to be written
+        Returns:
+          - the id of the question, raises the error it failed with or TimeoutError
+        '''
+        if not self._done.wait(timeout):
+            raise TimeoutError("question not written after {} seconds".format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.id
+
+
+class WriteBehindQueue:
+    '''
+    Queues new questions and writes them in grouped transactions from one background thread
+    '''
+
+    def __init__(self, app, batch_size=BATCH_SIZE, max_delay=MAX_DELAY,
+                 queue_size=QUEUE_SIZE, ack="commit"):
+        if ack not in ACKS:
+            raise ValueError("unknown WRITE_BEHIND_ACK %r, choose one of %s" % (
+                ack, ", ".join(ACKS)))
+        self.app = app
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.ack = ack
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self._queue = queue.Queue(queue_size)
+        self.start()
+        atexit.register(self.close)
+
+    def start(self):
+        '''
+        This function starts the background thread, again in a forked worker,
+        which inherits the queue but not the thread
+        '''
+        self._queue = queue.Queue(self._queue.maxsize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, values):
+        '''
+        This function queues a validated question
+        Returns:
+          - the pending question, raises queue.Full when the queue is full
+        '''
+        pending = PendingQuestion(values)
+        self._queue.put_nowait(pending)
+        return pending
+
+    def close(self):
+        '''
+        This function writes what is still queued and stops the background thread
+        '''
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "ack": self.ack,
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+            "largest_batch": self.largest_batch,
+            "average_batch": round(self.written / self.batches, 2) if self.batches else 0,
+        }
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            batch = [pending for pending in batch if pending is not None]
+            if batch:
+                with self.app.app_context():
+                    try:
+                        self._write(batch)
+                    except Exception as error:
+                        # the thread must live on, the requests waiting get the error
+                        self.app.logger.exception("writing queued questions failed")
+                        for pending in batch:
+                            if not pending.done():
+                                pending.finish(error=error)
+                    finally:
+                        db.session.remove()
+            if closing:
+                return
+
+    def _write(self, batch):
+        try:
+            written = self._commit(batch)
+        except Exception:
+            db.session.rollback()
+            # find the questions that failed it, the others are written alone
+            written = []
+            for pending in batch:
+                try:
+                    written += self._commit([pending])
+                except Exception as error:
+                    db.session.rollback()
+                    self.failed += 1
+                    pending.finish(error=error)
+                    if self.ack == "queued":
+                        self.app.logger.exception("writing a queued question failed")
+        if written:
+            self.batches += 1
+            self.written += len(written)
+            self.largest_batch = max(self.largest_batch, len(written))
+            notify_question_listeners("insert", [question for _, question in written])
+        # answered once the counts and the index know the questions
+        for pending, question in written:
+            pending.finish(question['id'])
+
+    def _commit(self, batch):
+        questions = [Question(**pending.values) for pending in batch]
+        db.session.add_all(questions)
+        db.session.flush()
+        written = [(pending, question.format()) for pending, question in zip(batch, questions)]
+        db.session.commit()
+        return written
+
+
+def init_write_behind(app):
+    '''
+    This function starts the write-behind queue of the app when WRITE_BEHIND is True
+    '''
+    if not app.config.get("WRITE_BEHIND", False):
+        return
+    app.extensions["write_behind"] = WriteBehindQueue(
+        app,
+        batch_size=app.config.get("WRITE_BEHIND_BATCH_SIZE", BATCH_SIZE),
+        max_delay=app.config.get("WRITE_BEHIND_MAX_DELAY", MAX_DELAY),
+        queue_size=app.config.get("WRITE_BEHIND_QUEUE_SIZE", QUEUE_SIZE),
+        ack=app.config.get("WRITE_BEHIND_ACK", "commit"))
@@ -0,0 +1,303 @@
+import time
+
+'''
+migrations
+    ordered schema changes, replacing a bare db.create_all() so databases
+    created by older versions are brought up to date too. Every migration
+    runs once per database, the applied ones are recorded in the
+    schema_migrations table. Migrations check what they change, so they
+    are safe on databases created before they were recorded (e.g. from
+    trivia.psql)
+'''
+
+
+def create_tables(db, connection):
+    # tables missing so far, created with the current models
+    db.Model.metadata.create_all(bind=connection)
+
+
+def category_foreign_key(db, connection):
+    # categories are referenced by id, SQLite can't change a column's type
+    # or add constraints, but it compares the ids without casts anyway
+    if connection.dialect.name != "postgresql":
+        return
+    column_type = connection.execute(db.text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'questions' AND column_name = 'category'")).scalar()
+    if column_type != "integer":
+        connection.execute(db.text(
+            "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+            "USING category::integer"))
+    connection.execute(db.text(
+        "ALTER TABLE questions DROP CONSTRAINT IF EXISTS fk_questions_category"))
+    connection.execute(db.text(
+        "ALTER TABLE questions ADD CONSTRAINT fk_questions_category "
+        "FOREIGN KEY (category) REFERENCES categories (id)"))
+
+
+def lookup_indexes(db, connection):
+    # category pages and quiz seeks walk (category, id), difficulty
+    # filters use (category, difficulty)
+    connection.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_category_id "
+        "ON questions (category, id)"))
+    connection.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_category_difficulty "
+        "ON questions (category, difficulty)"))
+
+
+def search_vector(db, connection):
+    # full-text search column kept up to date by PostgreSQL (12+) itself,
+    # question text weighs more than the answer, plus its GIN index
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(db.text(
+        """ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector
+           GENERATED ALWAYS AS (
+               setweight(to_tsvector('english', coalesce(question, '')), 'A') ||
+               setweight(to_tsvector('english', coalesce(answer, '')), 'B')
+           ) STORED"""))
+    connection.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_search_vector "
+        "ON questions USING GIN (search_vector)"))
+
+
+# question_counts row holding the number of every question, category ids start at 1
+ALL_QUESTIONS = 0
+
+SQLITE_COUNT_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS question_counts_insert AFTER INSERT ON questions
+       BEGIN
+           INSERT OR IGNORE INTO question_counts (category, total)
+               SELECT NEW.category, 0 WHERE NEW.category IS NOT NULL;
+           UPDATE question_counts SET total = total + 1
+               WHERE category = 0 OR category = NEW.category;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS question_counts_delete AFTER DELETE ON questions
+       BEGIN
+           UPDATE question_counts SET total = total - 1
+               WHERE category = 0 OR category = OLD.category;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS question_counts_update AFTER UPDATE OF category ON questions
+       WHEN OLD.category IS NOT NEW.category
+       BEGIN
+           INSERT OR IGNORE INTO question_counts (category, total)
+               SELECT NEW.category, 0 WHERE NEW.category IS NOT NULL;
+           UPDATE question_counts SET total = total - 1 WHERE category = OLD.category;
+           UPDATE question_counts SET total = total + 1 WHERE category = NEW.category;
+       END""",
+]
+
+# statement-level triggers, so an import of thousands of rows updates each
+# counter once; counters are locked in category order, which keeps
+# concurrent writers from deadlocking on them
+POSTGRESQL_COUNT_CHANGES = {
+    "insert": ("REFERENCING NEW TABLE AS new_rows",
+               "SELECT 0 AS category, 1 AS change FROM new_rows "
+               "UNION ALL SELECT category, 1 FROM new_rows WHERE category IS NOT NULL"),
+    "delete": ("REFERENCING OLD TABLE AS old_rows",
+               "SELECT 0 AS category, -1 AS change FROM old_rows "
+               "UNION ALL SELECT category, -1 FROM old_rows WHERE category IS NOT NULL"),
+    "update": ("REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+               "SELECT category, 1 AS change FROM new_rows WHERE category IS NOT NULL "
+               "UNION ALL SELECT category, -1 FROM old_rows WHERE category IS NOT NULL"),
+}
+
+
+def postgresql_count_triggers():
+    statements = []
+    for action, (transition_tables, changes) in POSTGRESQL_COUNT_CHANGES.items():
+        statements += [
+            """CREATE OR REPLACE FUNCTION question_counts_{0}() RETURNS trigger AS $$
+               BEGIN
+                   INSERT INTO question_counts (category, total)
+                   SELECT category, sum(change) FROM ({1}) changes
+                   GROUP BY category HAVING sum(change) <> 0 ORDER BY category
+                   ON CONFLICT (category) DO UPDATE
+                       SET total = question_counts.total + EXCLUDED.total;
+                   RETURN NULL;
+               END
+               $$ LANGUAGE plpgsql""".format(action, changes),
+            "DROP TRIGGER IF EXISTS question_counts_{0} ON questions".format(action),
+            """CREATE TRIGGER question_counts_{0} AFTER {1} ON questions {2}
+               FOR EACH STATEMENT EXECUTE FUNCTION question_counts_{0}()""".format(
+                action, action.upper(), transition_tables),
+        ]
+    return statements
+
+
+def recount_questions(db, connection):
+    '''
+    sets the question counters to the counts of the questions table
+    returns the counters that were wrong, {category: (counter, count)}
+    '''
+    # no write may land between the count and the fix: PostgreSQL blocks
+    # the writers (not the readers) of questions, a write statement takes
+    # SQLite's database-wide write lock
+    if connection.dialect.name == "postgresql":
+        connection.execute(db.text("LOCK TABLE questions IN SHARE MODE"))
+    else:
+        connection.execute(db.text(
+            "UPDATE question_counts SET total = total WHERE category = :category"),
+            category=ALL_QUESTIONS)
+    # integer keys whatever the type of the column, as the triggers count them
+    counts = {int(category): count for category, count in connection.execute(db.text(
+        "SELECT CAST(category AS INTEGER), count(id) FROM questions "
+        "WHERE category IS NOT NULL GROUP BY CAST(category AS INTEGER)")).fetchall()}
+    counts[ALL_QUESTIONS] = connection.execute(db.text(
+        "SELECT count(id) FROM questions")).scalar()
+    counters = dict(connection.execute(db.text(
+        "SELECT category, total FROM question_counts")).fetchall())
+
+    wrong = {category: (counters.get(category), counts.get(category, 0))
+             for category in set(counts) | set(counters)
+             if counters.get(category) != counts.get(category, 0)}
+    for category, (counter, count) in sorted(wrong.items()):
+        if counter is None:
+            statement = "INSERT INTO question_counts (category, total) VALUES (:category, :total)"
+        else:
+            statement = "UPDATE question_counts SET total = :total WHERE category = :category"
+        connection.execute(db.text(statement), category=category, total=count)
+    return wrong
+
+
+def question_counters(db, connection):
+    # per-category and total question counts kept by triggers, so the
+    # totals the API reports are read from one row instead of counted
+    connection.execute(db.text(
+        "CREATE TABLE IF NOT EXISTS question_counts ("
+        "category INTEGER PRIMARY KEY, total INTEGER NOT NULL)"))
+    triggers = postgresql_count_triggers() if connection.dialect.name == "postgresql" \
+        else SQLITE_COUNT_TRIGGERS
+    for trigger in triggers:
+        connection.execute(db.text(trigger))
+    recount_questions(db, connection)
+
+
+# tables whose writes are counted in table_versions
+VERSIONED_TABLES = ("questions", "categories")
+# seconds since the epoch, as time.time()
+SQLITE_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+
+
+def table_version_triggers(dialect):
+    if dialect != "postgresql":
+        # SQLite has no statement triggers, every row written bumps the version
+        return ["""CREATE TRIGGER IF NOT EXISTS {0}_version_{1} AFTER {2} ON {0}
+                   BEGIN
+                       UPDATE table_versions SET version = version + 1, modified = {3}
+                           WHERE name = '{0}';
+                   END""".format(table, action.lower(), action, SQLITE_NOW)
+                for table in VERSIONED_TABLES for action in ("INSERT", "UPDATE", "DELETE")]
+    statements = [
+        """CREATE OR REPLACE FUNCTION table_versions_bump() RETURNS trigger AS $$
+           BEGIN
+               UPDATE table_versions SET version = version + 1,
+                   modified = extract(epoch FROM clock_timestamp())
+               WHERE name = TG_TABLE_NAME;
+               RETURN NULL;
+           END
+           $$ LANGUAGE plpgsql"""]
+    for table in VERSIONED_TABLES:
+        statements += [
+            "DROP TRIGGER IF EXISTS {0}_version ON {0}".format(table),
+            """CREATE TRIGGER {0}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {0}
+               FOR EACH STATEMENT EXECUTE FUNCTION table_versions_bump()""".format(table),
+        ]
+    return statements
+
+
+def table_versions(db, connection):
+    # write counters of the tables kept by triggers, so every process
+    # sees the writes of the others (models.TableVersions)
+    connection.execute(db.text(
+        "CREATE TABLE IF NOT EXISTS table_versions ("
+        "name VARCHAR(64) PRIMARY KEY, version BIGINT NOT NULL, "
+        "modified DOUBLE PRECISION NOT NULL)"))
+    for table in VERSIONED_TABLES:
+        connection.execute(db.text(
+            "INSERT INTO table_versions (name, version, modified) "
+            "SELECT :name, 0, :modified WHERE NOT EXISTS "
+            "(SELECT 1 FROM table_versions WHERE name = :name)"),
+            name=table, modified=time.time())
+    for trigger in table_version_triggers(connection.dialect.name):
+        connection.execute(db.text(trigger))
+
+
+# a legacy database keeps the category as text (migration 2 leaves SQLite
+# alone), the counters are keyed by its integer value
+SQLITE_INTEGER_COUNT_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS question_counts_insert",
+    """CREATE TRIGGER question_counts_insert AFTER INSERT ON questions
+       BEGIN
+           INSERT OR IGNORE INTO question_counts (category, total)
+               SELECT CAST(NEW.category AS INTEGER), 0 WHERE NEW.category IS NOT NULL;
+           UPDATE question_counts SET total = total + 1
+               WHERE category = 0 OR category = CAST(NEW.category AS INTEGER);
+       END""",
+    "DROP TRIGGER IF EXISTS question_counts_delete",
+    """CREATE TRIGGER question_counts_delete AFTER DELETE ON questions
+       BEGIN
+           UPDATE question_counts SET total = total - 1
+               WHERE category = 0 OR category = CAST(OLD.category AS INTEGER);
+       END""",
+    "DROP TRIGGER IF EXISTS question_counts_update",
+    """CREATE TRIGGER question_counts_update AFTER UPDATE OF category ON questions
+       WHEN CAST(OLD.category AS INTEGER) IS NOT CAST(NEW.category AS INTEGER)
+       BEGIN
+           INSERT OR IGNORE INTO question_counts (category, total)
+               SELECT CAST(NEW.category AS INTEGER), 0 WHERE NEW.category IS NOT NULL;
+           UPDATE question_counts SET total = total - 1
+               WHERE category = CAST(OLD.category AS INTEGER) AND category <> 0;
+           UPDATE question_counts SET total = total + 1
+               WHERE category = CAST(NEW.category AS INTEGER) AND category <> 0;
+       END""",
+]
+
+
+def integer_count_triggers(db, connection):
+    # the SQLite counter triggers of migration 5 counted a text category
+    # apart from its integer counter row, replaced by ones that cast it
+    if connection.dialect.name == "postgresql":
+        return
+    for statement in SQLITE_INTEGER_COUNT_TRIGGERS:
+        connection.execute(db.text(statement))
+    recount_questions(db, connection)
+
+
+MIGRATIONS = [
+    (1, "create tables", create_tables),
+    (2, "integer category with a foreign key", category_foreign_key),
+    (3, "category lookup indexes", lookup_indexes),
+    (4, "full-text search vector", search_vector),
+    (5, "question counters", question_counters),
+    (6, "table versions", table_versions),
+    (7, "integer category counter triggers", integer_count_triggers),
+]
+
+
+def migrate(db):
+    '''
+    applies the migrations the database of the current app hasn't had yet
+    returns the versions that were applied
+    '''
+    applied = []
+    with db.engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # one process migrates at a time, the others wait and find it done
+            connection.execute(db.text("SELECT pg_advisory_xact_lock(4216)"))
+        connection.execute(db.text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(100), applied_at FLOAT)"))
+        done = {row[0] for row in connection.execute(
+            db.text("SELECT version FROM schema_migrations"))}
+        for version, name, migration in MIGRATIONS:
+            if version in done:
+                continue
+            migration(db, connection)
+            connection.execute(db.text(
+                "INSERT INTO schema_migrations (version, name, applied_at) "
+                "VALUES (:version, :name, :applied_at)"),
+                version=version, name=name, applied_at=time.time())
+            applied.append(version)
+    return applied
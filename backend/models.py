@@ -1,16 +1,289 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import time
+import threading
+import itertools
+import uuid
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, event
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select, UpdateBase
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
+from migrations import migrate, recount_questions, ALL_QUESTIONS
 
 database_name = "trivia"
 password = "postgres"
 username = 'postgres'
 url = 'localhost:5432'
-database_path = "postgresql://{}:{}@{}/{}".format(
-    username, password, url, database_name)
+database_path = os.environ.get("TRIVIA_DATABASE_URL", "postgresql://{}:{}@{}/{}".format(
+    username, password, url, database_name))
+
+
+'''
+RoutingSession
+    sends plain SELECTs to a read replica when the app has some (see
+    ReplicaRouter), everything else to the primary. Once the session wrote,
+    and for DB_READ_YOUR_WRITES seconds after this process wrote questions
+    or categories, reads stay on the primary so they see the write
+'''
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get("replicas")
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.wrote = True
+        elif replicas is not None and isinstance(clause, Select) and not self.wrote \
+                and time.time() - table_versions.modified("questions", "categories") \
+                >= replicas.read_your_writes:
+            engine = replicas.engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+# seconds a cached question count is trusted before it is re-counted,
+# bounds how stale totals can get when another process writes
+COUNT_CACHE_TTL = 5
+# seconds the category cache is served before it is reloaded
+CATEGORY_CACHE_TTL = 300
+
+# connection pool and statement settings, read from the app config
+# or from the environment as TRIVIA_<name>, e.g. TRIVIA_DB_POOL_SIZE=20
+DATABASE_SETTINGS = {
+    "DB_POOL_SIZE": 10,             # connections kept open
+    "DB_MAX_OVERFLOW": 20,          # extra connections opened under bursts
+    "DB_POOL_TIMEOUT": 30,          # seconds to wait for a free connection
+    "DB_POOL_RECYCLE": 1800,        # seconds before a connection is replaced
+    "DB_POOL_PRE_PING": True,       # test connections before handing them out
+    "DB_STATEMENT_TIMEOUT": 0,      # milliseconds, 0 for no limit (PostgreSQL)
+    "DB_STATEMENT_CACHE_SIZE": 100,  # prepared statements per asyncpg connection
+    "DB_REPLICA_URLS": "",          # comma separated read replicas
+    "DB_REPLICA_CHECK_INTERVAL": 5,  # seconds between health checks of a replica
+    "DB_READ_YOUR_WRITES": 0,       # seconds reads stay on the primary after a write
+    "DB_COUNT_RECONCILE_INTERVAL": 3600,  # seconds between recounts of the question counters, 0 for never
+    "DB_TABLE_VERSION_INTERVAL": 1,  # seconds between reads of the shared table versions, 0 for every request
+}
+
+'''
+database_setting(config, name)
+    returns the value of one of DATABASE_SETTINGS, from the config,
+    the environment or the default, in that order
+'''
+
+
+def database_setting(config, name):
+    default = DATABASE_SETTINGS[name]
+    value = config.get(name) if config is not None else None
+    if value is None:
+        value = os.environ.get("TRIVIA_" + name)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return str(value).lower() in ("1", "true", "yes")
+    if isinstance(default, str) and isinstance(value, (list, tuple)):
+        return ",".join(value)
+    return type(default)(value)
+
+
+'''
+TimedQueuePool
+    QueuePool that also counts the checkouts and how long they waited
+    for a free connection
+'''
+
+
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+'''
+engine_options(config, database_path)
+    returns the create_engine options of the pool settings
+'''
+
+
+def engine_options(config, database_path):
+    sa_url = make_url(database_path)
+    options = {
+        "pool_pre_ping": database_setting(config, "DB_POOL_PRE_PING"),
+        "pool_recycle": database_setting(config, "DB_POOL_RECYCLE"),
+    }
+    if sa_url.drivername.startswith("sqlite"):
+        if sa_url.database in (None, "", ":memory:"):
+            # Flask-SQLAlchemy keeps the one in-memory connection
+            return options
+        # pooled SQLite connections are handed from thread to thread
+        options["connect_args"] = {"check_same_thread": False}
+    options.update({
+        "poolclass": TimedQueuePool,
+        "pool_size": database_setting(config, "DB_POOL_SIZE"),
+        "max_overflow": database_setting(config, "DB_MAX_OVERFLOW"),
+        "pool_timeout": database_setting(config, "DB_POOL_TIMEOUT"),
+    })
+    statement_timeout = database_setting(config, "DB_STATEMENT_TIMEOUT")
+    if statement_timeout and sa_url.drivername.startswith("postgres"):
+        options["connect_args"] = {
+            "options": "-c statement_timeout={:d}".format(statement_timeout)}
+    return options
+
+
+'''
+ReplicaRouter
+    hands out the engines of the read replicas in turn, skipping the ones
+    that failed their last health check (a SELECT 1 run at most every
+    `check_interval` seconds, or a dropped connection)
+'''
+
+
+class Replica:
+
+    def __init__(self, url, engine):
+        self.url = url
+        self.engine = engine
+        self.reads = 0
+        self.failures = 0
+        self.healthy = True
+        self.checked_at = 0
+        event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            self.mark(False)
+
+    def mark(self, healthy):
+        if not healthy:
+            self.failures += 1
+        self.healthy = healthy
+        self.checked_at = time.time()
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.execute("SELECT 1")
+            self.mark(True)
+        except Exception:
+            self.mark(False)
+
+
+class ReplicaRouter:
+
+    def __init__(self, config, urls):
+        self.check_interval = database_setting(config, "DB_REPLICA_CHECK_INTERVAL")
+        self.read_your_writes = database_setting(config, "DB_READ_YOUR_WRITES")
+        self.replicas = [Replica(url, create_engine(url, **engine_options(config, url)))
+                         for url in urls]
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def engine(self):
+        '''
+        returns the engine of the next healthy replica, None if none is healthy
+        '''
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._turn) % len(self.replicas)]
+            if time.time() - replica.checked_at >= self.check_interval:
+                with self._lock:
+                    if time.time() - replica.checked_at >= self.check_interval:
+                        replica.check()
+            if replica.healthy:
+                replica.reads += 1
+                return replica.engine
+        return None
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def stats(self):
+        return [{
+            "url": repr(make_url(replica.url)),
+            "healthy": replica.healthy,
+            "reads": replica.reads,
+            "failures": replica.failures,
+        } for replica in self.replicas]
+
+
+def replica_router(config):
+    '''
+    returns the ReplicaRouter of DB_REPLICA_URLS, None without replicas
+    '''
+    urls = [url.strip() for url in database_setting(config, "DB_REPLICA_URLS").split(",")
+            if url.strip()]
+    return ReplicaRouter(config, urls) if urls else None
+
+
+'''
+replica_stats()
+    returns the health and reads of every replica of the current app
+'''
+
+
+def replica_stats():
+    replicas = db.get_app().extensions.get("replicas")
+    return replicas.stats() if replicas is not None else []
+
+
+'''
+pool_stats()
+    returns how the connection pool of the current app is used
+'''
+
+
+def pool_stats():
+    pool = db.engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(0, pool.overflow()),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            "checkouts": pool.checkouts,
+            "timeouts": pool.timeouts,
+            "wait_ms_total": pool.wait_seconds * 1000,
+            "wait_ms_max": pool.max_wait_seconds * 1000,
+        })
+    return stats
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
@@ -21,9 +294,61 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # engine options given in the config win over the DB_* settings,
+    # kept apart so binding the app again starts from them and not from ours
+    overrides = app.extensions.setdefault(
+        "engine_options", dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})))
+    options = engine_options(app.config, database_path)
+    options.update(overrides)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if app.extensions.get("replicas") is not None:
+        app.extensions["replicas"].dispose()
+    app.extensions["replicas"] = replica_router(app.config)
+    migrate(db)
+    app.extensions["count_reconciler"] = CountReconciler(
+        app, database_setting(app.config, "DB_COUNT_RECONCILE_INTERVAL"))
+    # a new database may hold other rows than the ones cached so far
+    invalidate_question_counts()
+    category_cache.invalidate()
+    # the search index and its cached pages were read from the old database
+    app.extensions.pop("search_index", None)
+    if app.extensions.get("search_cache") is not None:
+        app.extensions["search_cache"].clear()
+    table_versions.reset(database_setting(app.config, "DB_TABLE_VERSION_INTERVAL"))
+    table_versions.bump("questions")
+    table_versions.bump("categories")
+
+
+'''
+CategoryId
+    an integer category id read back as an int from a legacy SQLite
+    database too, which keeps the column as text (migration 2 leaves
+    SQLite alone)
+'''
+
+
+class CategoryId(TypeDecorator):
+    impl = Integer
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else int(value)
+
+
+'''
+reset_after_fork(app)
+    drops the pooled connections a forked process (gunicorn --preload)
+    inherited from the one that set the database up, processes can't
+    share them, so it opens its own
+'''
+
+
+def reset_after_fork(app):
+    with app.app_context():
+        db.engine.dispose()
+    if app.extensions.get("replicas") is not None:
+        app.extensions["replicas"].dispose()
 
 
 '''
@@ -34,11 +359,16 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(CategoryId, ForeignKey(
+        'categories.id', name='fk_questions_category'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -49,14 +379,21 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        written = self.format()
         db.session.commit()
+        notify_question_listeners("insert", [written])
 
     def update(self):
+        written = self.format()
         db.session.commit()
+        notify_question_listeners("update", [written])
 
     def delete(self):
+        written = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_question_listeners("delete", [written])
 
     def format(self):
         return {
@@ -68,6 +405,180 @@ class Question(db.Model):
         }
 
 
+'''
+question_rows(query, fields=QUESTION_FIELDS)
+    runs a Question query for the columns of the fields only, without
+    building Question objects, returns the questions formatted like
+    Question.format() with only those fields
+'''
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def question_rows(query, fields=QUESTION_FIELDS):
+    columns = [getattr(Question, field) for field in fields]
+    return [dict(zip(fields, row)) for row in query.with_entities(*columns)]
+
+
+'''
+QuestionCount
+    the number of questions of a category, and of every question under
+    ALL_QUESTIONS, kept by database triggers on questions in the same
+    transaction as the write (see migrations.question_counters)
+'''
+
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    total = Column(Integer, nullable=False)
+
+
+'''
+question_count(category=None)
+    returns the number of questions, optionally within one category,
+    read from its counter row instead of counting the questions, and
+    cached for COUNT_CACHE_TTL seconds
+'''
+_question_counts = {}
+
+
+def question_count(category=None):
+    if category is not None:
+        category = int(category)
+    cached = _question_counts.get(category)
+    if cached is not None and time.time() - cached[1] < COUNT_CACHE_TTL:
+        return cached[0]
+
+    reconciler = db.get_app().extensions.get("count_reconciler")
+    if reconciler is not None:
+        reconciler.start_if_due()
+    total = db.session.query(QuestionCount.total).filter(
+        QuestionCount.category == (ALL_QUESTIONS if category is None else category)).scalar()
+    total = total or 0
+    _question_counts[category] = (total, time.time())
+    return total
+
+
+def reconcile_question_counts():
+    '''
+    recounts the questions into their counters, fixing the ones that drifted
+    (e.g. rows changed by hand with the triggers disabled)
+    returns the counters that were wrong, {category: (counter, count)}
+    '''
+    with db.engine.begin() as connection:
+        wrong = recount_questions(db, connection)
+    if wrong:
+        db.get_app().logger.warning("question counters were wrong, fixed: %s", wrong)
+        invalidate_question_counts()
+    return wrong
+
+
+'''
+CountReconciler
+    recounts the question counters of an app in a background thread,
+    started by the first count asked for `interval` seconds after the last
+'''
+
+
+class CountReconciler:
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.started_at = time.time()   # the migrations just counted
+        self.runs = 0
+        self.corrections = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def start_if_due(self):
+        if not self.interval or time.time() - self.started_at < self.interval:
+            return
+        with self._lock:
+            if time.time() - self.started_at < self.interval:
+                return
+            self.started_at = time.time()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            with self.app.app_context():
+                self.corrections += len(reconcile_question_counts())
+            self.runs += 1
+        except Exception:
+            self.failures += 1
+            self.app.logger.exception("recounting the question counters failed")
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "last_started": self.started_at,
+            "runs": self.runs,
+            "corrections": self.corrections,
+            "failures": self.failures,
+        }
+
+
+def invalidate_question_counts():
+    _question_counts.clear()
+
+
+def adjust_question_counts(action, questions):
+    '''
+    keeps the cached counts right after questions were added or removed,
+    so the next total doesn't have to count the table again
+    '''
+    if action not in ("insert", "import", "delete"):
+        # an update may have moved questions to another category
+        invalidate_question_counts()
+        return
+    step = -1 if action == "delete" else 1
+    try:
+        changes = {None: step * len(questions)}
+        for question in questions:
+            category = int(question['category'])
+            changes[category] = changes.get(category, 0) + step
+    except (TypeError, ValueError):
+        invalidate_question_counts()
+        return
+    for category, change in changes.items():
+        cached = _question_counts.get(category)
+        if cached is not None:
+            _question_counts[category] = (cached[0] + change, cached[1])
+
+
+def delete_questions(ids):
+    '''
+    deletes the questions with the given ids in one statement and one transaction
+    returns the formatted questions that were deleted
+    '''
+    query = Question.query.filter(Question.id.in_(ids))
+    deleted = [question.format() for question in query.all()]
+    if deleted:
+        query.delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        notify_question_listeners("delete", deleted)
+    return deleted
+
+
+'''
+question_listeners
+    callables run after questions were committed, with the action
+    ("insert", "update" or "delete") and the formatted questions, or
+    "import" and the written values when the new ids aren't known
+'''
+question_listeners = []
+
+
+def notify_question_listeners(action, questions):
+    adjust_question_counts(action, questions)
+    table_versions.bump("questions")
+    for listener in question_listeners:
+        listener(action, questions)
+
+
 '''
 Category
 
@@ -83,8 +594,159 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        category_cache.invalidate()
+        table_versions.bump("categories")
+
+    def update(self):
+        db.session.commit()
+        category_cache.invalidate()
+        table_versions.bump("categories")
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        category_cache.invalidate()
+        table_versions.bump("categories")
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+TableVersions
+    per-table write counters, they let the API tell whether a response
+    could have changed without querying. The versions are the ones of the
+    table_versions table, kept by triggers (migrations 6) for the writes
+    of every process, so all processes agree on them. `refresh` reads them
+    at most every `interval` seconds, which bounds how long another
+    process's write goes unseen, and at once after a write of this
+    process (`bump`). The counters of this process, tagged with its `boot`
+    id, only stand in while the table can't be read
+'''
+
+
+class TableVersions:
+
+    def __init__(self):
+        self.boot = uuid.uuid4().hex[:8]
+        self._versions = {}   # table -> (version, time of the last write)
+        self._shared = {}     # table -> (version, time of the last write), from the database
+        self._read_at = 0
+        self.interval = DATABASE_SETTINGS["DB_TABLE_VERSION_INTERVAL"]
+        self._lock = threading.Lock()
+
+    def reset(self, interval):
+        '''
+        forgets the shared versions, for a new database
+        '''
+        with self._lock:
+            self._shared = {}
+            self._read_at = 0
+            self.interval = interval
+
+    def refresh(self):
+        '''
+        reads the shared versions when they are older than the interval,
+        needs an app context
+        '''
+        if time.time() - self._read_at < self.interval:
+            return
+        self._read_at = time.time()
+        try:
+            # straight from the primary, a replica may lag behind it
+            with db.engine.connect() as connection:
+                rows = connection.execute(db.text(
+                    "SELECT name, version, modified FROM table_versions")).fetchall()
+        except Exception:
+            # keep the last ones, the local counters still move
+            return
+        self._shared = {name: (version, modified) for name, version, modified in rows}
+
+    def bump(self, table):
+        with self._lock:
+            version, _ = self._versions.get(table, (0, 0))
+            self._versions[table] = (version + 1, time.time())
+            # the triggers counted the write, read it at the next refresh
+            self._read_at = 0
+
+    def version(self, table):
+        '''
+        returns the shared version of the table, the same in every process,
+        or the one of this process while the shared ones can't be read
+        '''
+        if table in self._shared:
+            return str(self._shared[table][0])
+        return "{}.{}".format(self.boot, self._versions.get(table, (0, 0))[0])
+
+    def modified(self, *tables):
+        '''
+        returns the time of the latest write to any of the tables
+        '''
+        return max(max(self._versions.get(table, (0, 0))[1], self._shared.get(table, (0, 0))[1])
+                   for table in tables)
+
+
+table_versions = TableVersions()
+
+
+'''
+CategoryCache
+    keeps every category in memory so the read paths don't query them,
+    reloaded after `ttl` seconds or when Category.insert/update/delete
+    invalidates it
+'''
+
+
+class CategoryCache:
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._categories = None   # id -> type, newest category first
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def all(self):
+        '''
+        returns every category as {id: type}, the dict must not be changed
+        '''
+        categories = self._categories
+        if categories is not None and time.time() - self._loaded_at < self.ttl:
+            self.hits += 1
+            return categories
+        with self._lock:
+            self.misses += 1
+            categories = {category.id: category.type for category in
+                          Category.query.order_by(db.desc(Category.id)).all()}
+            self._categories = categories
+            self._loaded_at = time.time()
+        return categories
+
+    def get(self, category_id):
+        '''
+        returns the type of the category, None if there is no such category
+        '''
+        return self.all().get(category_id)
+
+    def invalidate(self):
+        self._categories = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": len(self._categories or {}),
+            "ttl": self.ttl
+        }
+
+
+category_cache = CategoryCache()
@@ -1,5 +1,6 @@
 import React, { Component } from "react";
 import $ from "jquery";
+import conditionalGet from "../conditionalGet";
 
 import "../stylesheets/FormView.css";
 
@@ -16,7 +17,7 @@ class FormView extends Component {
   }
 
   componentDidMount() {
-    $.ajax({
+    conditionalGet({
       url: `/categories`, //TODO: update request URL
       type: "GET",
       success: (result) => {
@@ -4,6 +4,7 @@ import '../stylesheets/App.css';
 import Question from './Question';
 import Search from './Search';
 import $ from 'jquery';
+import conditionalGet from '../conditionalGet';
 class QuestionView extends Component {
   constructor(){
     super();
@@ -21,14 +22,16 @@ class QuestionView extends Component {
   }
 
   getQuestions = () => {
-    $.ajax({
-      url: `/questions?page=${this.state.page}`, //TODO: update request URL
+    // the categories don't change from page to page, only ask for them once
+    const haveCategories = Object.keys(this.state.categories).length > 0;
+    conditionalGet({
+      url: `/questions?page=${this.state.page}${haveCategories ? '&categories=false' : ''}`,
       type: "GET",
       success: (result) => {
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
-          categories: result.categories,
+          categories: result.categories || this.state.categories,
           currentCategory: result.current_category })
         return;
       },
@@ -58,7 +61,7 @@ class QuestionView extends Component {
   }
 
   getByCategory= (id) => {
-    $.ajax({
+    conditionalGet({
       url: `/categories/${id}/questions`, //TODO: update request URL
       type: "GET",
       success: (result) => {
@@ -104,7 +107,7 @@ class QuestionView extends Component {
     if(action === 'DELETE') {
       if(window.confirm('are you sure you want to delete the question?')) {
         $.ajax({
-          url: `/questions/${id}`, //TODO: update request URL
+          url: `/questions/${id}?lean=true`, //TODO: update request URL
           type: "DELETE",
           success: (result) => {
             this.getQuestions();
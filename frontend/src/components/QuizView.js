@@ -1,5 +1,6 @@
 import React, { Component } from 'react';
 import $ from 'jquery';
+import conditionalGet from '../conditionalGet';
 
 import '../stylesheets/QuizView.css';
 
@@ -11,6 +12,7 @@ class QuizView extends Component {
     this.state = {
         quizCategory: null,
         previousQuestions: [], 
+        roundQuestions: [],
         showAnswer: false,
         categories: {},
         numCorrect: 0,
@@ -21,7 +23,7 @@ class QuizView extends Component {
   }
 
   componentDidMount(){
-    $.ajax({
+    conditionalGet({
       url: `/categories`, //TODO: update request URL
       type: "GET",
       success: (result) => {
@@ -36,38 +38,31 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.getRound)
   }
 
   handleChange = (event) => {
     this.setState({[event.target.name]: event.target.value})
   }
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions]
-    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
+  getRound = () => {
+    // the questions of the whole round in one request
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        previous_questions: [],
+        quiz_category: this.state.quizCategory,
+        count: questionsPerPlay
       }),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question['question']=="" ? true : false
-        })
+        this.setState({roundQuestions: result.questions}, this.getNextQuestion)
         return;
       },
       error: (error) => {
@@ -77,6 +72,20 @@ class QuizView extends Component {
     })
   }
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions]
+    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
+
+    const nextQuestion = this.state.roundQuestions[previousQuestions.length]
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      currentQuestion: nextQuestion || {},
+      guess: '',
+      forceEnd: nextQuestion ? false : true
+    })
+  }
+
   submitGuess = (event) => {
     event.preventDefault();
     const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
@@ -91,6 +100,7 @@ class QuizView extends Component {
     this.setState({
       quizCategory: null,
       previousQuestions: [], 
+      roundQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
@@ -0,0 +1,27 @@
+import $ from 'jquery';
+
+// last response and ETag of every GET url, so the request is revalidated
+// with If-None-Match and a 304 is answered from here
+const responses = {};
+
+const conditionalGet = ({url, success, ...options}) => {
+  const cached = responses[url];
+  return $.ajax({
+    ...options,
+    url,
+    type: "GET",
+    headers: cached ? {'If-None-Match': cached.etag} : {},
+    success: (result, status, xhr) => {
+      if (xhr.status === 304 && cached) {
+        return success(cached.result, status, xhr);
+      }
+      const etag = xhr.getResponseHeader('ETag');
+      if (etag) {
+        responses[url] = {etag, result};
+      }
+      return success(result, status, xhr);
+    }
+  });
+}
+
+export default conditionalGet;